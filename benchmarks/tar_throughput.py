@@ -0,0 +1,81 @@
+"""
+benchmarks.tar_throughput
+=========================
+
+Compress the same directory with every codec ``dotpy.Tar`` supports and
+print the throughput and ratio of each.
+
+    PYTHONPATH=lib python benchmarks/tar_throughput.py [SIZE_MB]
+"""
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+import time
+
+import dotpy
+
+
+def make_tree(root, size):
+    """Fill a directory with files of text that compresses about as
+    well as source code does.
+
+    :param root:    Directory to fill.
+    :param size:    Total size in bytes.
+    """
+    rand = random.Random(0)
+    words = [
+        "".join(rand.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(8))
+        for _ in range(2048)
+    ]
+    written = 0
+    count = 0
+    while written < size:
+        data = " ".join(rand.choice(words) for _ in range(64 * 1024))
+        with open(os.path.join(root, f"{count}.txt"), "w") as fout:
+            fout.write(data)
+
+        written += len(data)
+        count += 1
+
+    return written
+
+
+def main():
+    """Run every codec over the same tree and print the results."""
+    size = int(sys.argv[1] if len(sys.argv) > 1 else 64) << 20
+    jobs = os.cpu_count() or 1
+    cases = [
+        ("none", None, 1),
+        ("gz", None, 1),
+        ("gz", 6, 1),
+        ("gz", 6, max(jobs, 4)),
+        ("gz", 9, jobs),
+        ("bz2", None, 1),
+        ("xz", 1, 1),
+    ]
+    if importlib.util.find_spec("zstandard") is not None:
+        cases += [("zst", 3, 1), ("zst", 3, jobs)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "src")
+        os.mkdir(src)
+        total = make_tree(src, size)
+        print(f"{total / (1 << 20):.0f} MiB, {jobs} cpus")
+        print(f"{'codec':<6}{'level':>6}{'jobs':>6}{'MiB/s':>10}{'ratio':>8}")
+        for codec, level, njobs in cases:
+            archive = os.path.join(tmp, "archive" + dotpy.Tar.CODECS[codec])
+            start = time.perf_counter()
+            dotpy.Tar(src, archive, codec, level, njobs).compress()
+            elapsed = time.perf_counter() - start
+            ratio = total / os.path.getsize(archive)
+            print(
+                f"{codec:<6}{str(level or '-'):>6}{njobs:>6}"
+                f"{total / elapsed / (1 << 20):>10.1f}{ratio:>8.2f}"
+            )
+            os.remove(archive)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+benchmarks.textio_lines
+=======================
+
+Time ``dotpy.TextIO`` de-duplicating, sorting and writing a generated
+file with a lot of repeated lines, against the list based de-duplication
+and line by line writes it replaced.
+
+    PYTHONPATH=lib python benchmarks/textio_lines.py [LINES]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import dotpy
+
+
+def make_lines(count):
+    """Make lines like those of a requirements file, about a third of
+    them repeated.
+
+    :param count:   Number of lines.
+    :return:        List of lines.
+    """
+    rand = random.Random(0)
+    return [
+        f"package-{rand.randrange(count * 2 // 3)}==1.{rand.randrange(10)}"
+        for _ in range(count)
+    ]
+
+
+def old_deduplicate(lines):
+    """De-duplicate the way ``TextIO`` used to.
+
+    :param lines:   List of lines.
+    :return:        List of lines without duplicates.
+    """
+    newlines = []
+    for line in lines:
+        if line not in newlines:
+            newlines.append(line)
+
+    return newlines
+
+
+def old_write(path, lines):
+    """Write the way ``TextIO`` used to.
+
+    :param path:    Path to write to.
+    :param lines:   List of lines.
+    """
+    with open(path, "w") as file:
+        for line in lines:
+            file.write(f"{line}\n")
+
+
+def timed(func, *args):
+    """Run a function and time it.
+
+    :param func:    Function to run.
+    :param args:    Args to run it with.
+    :return:        Seconds taken.
+    """
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    """Time each operation and print the results."""
+    count = int(sys.argv[1] if len(sys.argv) > 1 else 100000)
+    lines = make_lines(count)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "requirements.txt")
+        textio = dotpy.TextIO(path)
+        # quadratic, so only timed while it finishes in seconds
+        old = None
+        if count <= 20000:
+            old = timed(lambda: old_deduplicate(sorted(lines)))
+
+        def sort_deduplicate():
+            textio.lines = list(lines)
+            textio.sort()
+            textio.deduplicate()
+
+        def sort_unique():
+            textio.lines = list(lines)
+            textio.sort_unique()
+
+        cases = [
+            ("sort + old deduplicate", old),
+            ("sort + deduplicate", timed(sort_deduplicate)),
+            ("sort_unique", timed(sort_unique)),
+            ("old write", timed(old_write, path, lines)),
+            ("write", timed(textio.write, *lines)),
+            ("write unchanged", timed(textio.write, *lines)),
+        ]
+
+    print(f"{count} lines")
+    for name, elapsed in cases:
+        if elapsed is None:
+            print(f"{name:<24}{'skipped':>12}")
+        else:
+            print(f"{name:<24}{elapsed * 1000:>12.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
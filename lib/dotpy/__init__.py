@@ -1,56 +1,83 @@
-from .src import (
-    CONFIG,
-    CONFIGDIR,
-    DATE,
-    DOCS,
-    DOTCONTENTS,
-    GNUPG_PASSPHRASE,
-    HOME,
-    LIB,
-    LOCKPATH,
-    PACKAGE,
-    PACKAGENAME,
-    PIPFILELOCK,
-    PYLIB,
-    README,
-    READMEPATH,
-    REPOPATH,
-    REQPATH,
-    REQUIREMENTS,
-    TIME,
-    SUFFIX,
-    WHITELIST,
-    WHITELISTPATH,
-    HashCap,
-    Index,
-    MaxSizeList,
-    Tar,
-    TextIO,
-    Yaml,
-    announce,
-    iter_repo,
-    pipe_command,
-)
-from .src import (
-    cryptdir,
-    docs_title,
-    install,
-    mkarchive,
-    repo_whitelist,
-    reponame,
-    reporeqs,
-    repotoc,
-    symlink_vim,
-)
+"""
+dotpy
+=====
+
+Names from ``dotpy.src`` and its subcommand modules are only imported
+the first time they are used.
+"""
+import importlib
+
+from . import src
+
+# ``__getattr__`` imports these at runtime, static tools see them here
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from .src import (
+        AtomicWrite,
+        BACKUPS,
+        CONFIG,
+        CONFIGDIR,
+        DATE,
+        DOCS,
+        DOTCONTENTS,
+        GNUPG_PASSPHRASE,
+        HASHCACHE,
+        HOME,
+        HashCache,
+        HashCap,
+        INDEXCACHE,
+        Index,
+        JOURNAL,
+        LIB,
+        LOCKPATH,
+        MaxSizeList,
+        PACKAGE,
+        PACKAGENAME,
+        PIPFILELOCK,
+        PYLIB,
+        README,
+        READMEPATH,
+        REPOPATH,
+        REQPATH,
+        REQSTATE,
+        REQUIREMENTS,
+        STATE,
+        SUFFIX,
+        TIME,
+        Tar,
+        TextIO,
+        WHITELIST,
+        WHITELISTCACHE,
+        WHITELISTPATH,
+        Yaml,
+        announce,
+        iter_repo,
+        pipe_command,
+    )
+    from .src import (
+        cryptdir,
+        docs_title,
+        install,
+        mkarchive,
+        repo_whitelist,
+        reponame,
+        reporeqs,
+        repotoc,
+        symlink_vim,
+    )
 
 __all__ = [
+    "BACKUPS",
     "CONFIG",
     "CONFIGDIR",
     "DATE",
     "DOCS",
     "DOTCONTENTS",
     "GNUPG_PASSPHRASE",
+    "HASHCACHE",
     "HOME",
+    "INDEXCACHE",
+    "JOURNAL",
     "LIB",
     "LOCKPATH",
     "PACKAGE",
@@ -62,12 +89,22 @@ __all__ = [
     "REPOPATH",
     "REQPATH",
     "REQUIREMENTS",
+    "REQSTATE",
+    "STATE",
+    "SUBCOMMANDS",
     "TIME",
     "SUFFIX",
     "WHITELIST",
+    "WHITELISTCACHE",
     "WHITELISTPATH",
+    "AtomicWrite",
+    "HashCache",
+    "HashCap",
+    "Index",
+    "MaxSizeList",
     "Tar",
     "TextIO",
+    "Yaml",
     "WHITELIST",
     "WHITELISTPATH",
     "announce",
@@ -83,3 +120,38 @@ __all__ = [
     "repotoc",
     "symlink_vim",
 ]
+
+
+SUBCOMMANDS = (
+    "cryptdir",
+    "docs_title",
+    "install",
+    "mkarchive",
+    "repo_whitelist",
+    "reponame",
+    "reporeqs",
+    "repotoc",
+    "symlink_vim",
+)
+
+
+def __getattr__(name):
+    """Import a subcommand module, or get a name from ``dotpy.src``, the
+    first time it is used.
+
+    :param name:    Name of the module or attribute.
+    :return:        The module or attribute.
+    """
+    if name in SUBCOMMANDS:
+        value = importlib.import_module(f"{src.__name__}.{name}")
+    else:
+        try:
+            value = getattr(src, name)
+
+        except AttributeError:
+            raise AttributeError(
+                f"module {__name__!r} has no attribute {name!r}"
+            ) from None
+
+    globals()[name] = value
+    return value
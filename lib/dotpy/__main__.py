@@ -0,0 +1,90 @@
+"""
+dotpy.__main__
+==============
+
+Run ``dotpy`` subcommands in a single interpreter::
+
+    python -m dotpy SUBCOMMAND [ARGS...]
+    python -m dotpy run SUBCOMMAND [ARGS...] [+ SUBCOMMAND [ARGS...]...]
+
+With ``run`` each subcommand is separated from the one before it by a
+lone ``+``, so an argument which happens to name a subcommand is still
+passed to the subcommand it follows. Dashes may be used in place of
+underscores e.g. ``docs-title``.
+"""
+import sys
+
+import dotpy
+
+USAGE = """\
+usage: python -m dotpy SUBCOMMAND [ARGS...]
+       python -m dotpy run SUBCOMMAND [ARGS...] [+ SUBCOMMAND [ARGS...]...]\
+"""
+SEPARATOR = "+"
+
+
+def _name(arg):
+    return arg.replace("-", "_")
+
+
+def split(args):
+    """Split the arguments to ``run`` into subcommands and their args.
+
+    :param args:    List of arguments following ``run``.
+    :return:        List of lists of subcommand and its args.
+    """
+    commands = [[]]
+    for arg in args:
+        if arg == SEPARATOR:
+            commands.append([])
+
+        else:
+            commands[-1].append(arg)
+
+    for command in commands:
+        if not command:
+            raise SystemExit(f"no subcommand given\n{USAGE}")
+
+        if _name(command[0]) not in dotpy.SUBCOMMANDS:
+            raise SystemExit(f"unknown subcommand: {command[0]}")
+
+        command[0] = _name(command[0])
+
+    return commands
+
+
+def run(name, *args):
+    """Run a subcommand as though it was called from its own script.
+
+    :param name:    Name of the subcommand.
+    :param args:    Commandline arguments for the subcommand.
+    """
+    sys.argv = [name, *args]
+    getattr(dotpy, name).main()
+
+
+def main():
+    """Run one subcommand or, with ``run``, several in turn. Stop at the
+    first one that exits.
+    """
+    args = sys.argv[1:]
+    if not args or args[0] in ("-h", "--help"):
+        print(USAGE)
+        print(f"subcommands: {', '.join(dotpy.SUBCOMMANDS)}")
+        return
+
+    if args[0] == "run":
+        commands = split(args[1:])
+
+    elif _name(args[0]) in dotpy.SUBCOMMANDS:
+        commands = [[_name(args[0]), *args[1:]]]
+
+    else:
+        raise SystemExit(f"unknown subcommand: {args[0]}")
+
+    for command in commands:
+        run(*command)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,31 @@
 """
 dotpy.src.__init__
 ==================
+
+Constants that need a costly import or lookup, ``CONFIGDIR``,
+``CONFIG``, ``DATE``, ``HOME``, ``SUFFIX`` and ``TIME``, are worked out
+the first time they are used, and modules which are costly to import,
+``appdirs``, ``yaml``, ``tarfile``, ``hashlib``, ``subprocess`` and
+``concurrent.futures``, which brings in ``logging``, are only imported by
+what needs them, so that tools which need none of them start quickly.
 """
+import bz2
+import collections
 import datetime
-import hashlib
+import fnmatch
+import gzip
+import io
+import json
+import lzma
+import marshal
+import mmap
 import os
 import pathlib
-import subprocess
-import tarfile
-
-import appdirs
-import yaml
+import shutil
+import tempfile
+import time
 
-CONFIGDIR = appdirs.user_config_dir(__name__)
-CONFIG = os.path.join(CONFIGDIR, __name__ + ".yaml")
-DATE = datetime.date.today().strftime("%Y/%m/%d")
+BACKUPS = "backups"
 DOTCONTENTS = dict(
     dirs={
         "~/.": {
@@ -41,34 +52,312 @@ LIB = os.path.dirname(PYLIB)
 REPOPATH = os.path.dirname(LIB)
 DOCS = os.path.join(REPOPATH, "docs")
 GNUPG_PASSPHRASE = os.environ.get("GNUPG_PASSPHRASE", "")
-HOME = str(pathlib.Path.home())
+HASHCACHE = "hash-cache.json"
+INDEXCACHE = "module-index.json"
+WHITELISTCACHE = "whitelist-cache.json"
+JOURNAL = "install-journal.jsonl"
 PIPFILELOCK = "Pipfile.lock"
 LOCKPATH = os.path.join(REPOPATH, PIPFILELOCK)
 PACKAGENAME = os.path.basename(REPOPATH)
 README = "README.rst"
 READMEPATH = os.path.join(REPOPATH, README)
 REQUIREMENTS = "requirements.txt"
+REQSTATE = "requirements-state.json"
 REQPATH = os.path.join(REPOPATH, REQUIREMENTS)
-SUFFIX = datetime.datetime.now().strftime("%d%m%YT%H%M%S")
-TIME = datetime.datetime.now().strftime("%H:%M:%S")
+STATE = "install-state.json"
 WHITELIST = "whitelist.py"
 WHITELISTPATH = os.path.join(REPOPATH, WHITELIST)
 
 
+def _configdir():
+    import appdirs
+
+    return appdirs.user_config_dir(__name__)
+
+
+def _config():
+    return os.path.join(_lazy("CONFIGDIR"), __name__ + ".yaml")
+
+
+def _date():
+    return datetime.date.today().strftime("%Y/%m/%d")
+
+
+def _home():
+    return str(pathlib.Path.home())
+
+
+def _suffix():
+    return datetime.datetime.now().strftime("%d%m%YT%H%M%S")
+
+
+def _time():
+    return datetime.datetime.now().strftime("%H:%M:%S")
+
+
+_LAZY = dict(
+    CONFIGDIR=_configdir,
+    CONFIG=_config,
+    DATE=_date,
+    HOME=_home,
+    SUFFIX=_suffix,
+    TIME=_time,
+)
+
+# annotated, not assigned, so that static tools know of them while
+# ``__getattr__`` still works them out
+CONFIGDIR: str
+CONFIG: str
+DATE: str
+HOME: str
+SUFFIX: str
+TIME: str
+
+
+def __getattr__(name):
+    """Work out a lazy constant the first time it is used and keep it.
+
+    :param name:    Name of the constant.
+    :return:        Value of the constant.
+    """
+    try:
+        value = _LAZY[name]()
+
+    except KeyError:
+        raise AttributeError(
+            f"module {__name__!r} has no attribute {name!r}"
+        ) from None
+
+    globals()[name] = value
+    return value
+
+
+def _lazy(name):
+    # a lazy constant for use within this module, where ``__getattr__``
+    # is not consulted for names that have not been worked out yet
+    try:
+        return globals()[name]
+
+    except KeyError:
+        return __getattr__(name)
+
+
+class _Lines:
+    """Lines of a memory-mapped file, split on newlines only as far as
+    they are used, and edits made to them. Lines are given without
+    their line endings, ``\r\n`` as well as ``\n``, as they are when the
+    file is read in full.
+
+    :param mapped: ``mmap`` of the file, or ``bytes`` if it is empty.
+    """
+
+    def __init__(self, mapped):
+        self.mapped = mapped
+        self.edits = {}
+        self._offsets = [0]
+        self._done = not mapped
+
+    def _split(self, index):
+        # find where lines start until the one after ``index`` is known
+        # or the end is reached, -1 for all of them
+        while not self._done and (
+            index < 0 or len(self._offsets) <= index + 1
+        ):
+            end = self.mapped.find(b"\n", self._offsets[-1])
+            if end == -1:
+                self._offsets.append(len(self.mapped) + 1)
+                self._done = True
+
+            else:
+                self._offsets.append(end + 1)
+                self._done = end + 1 == len(self.mapped)
+
+    def __len__(self):
+        self._split(-1)
+        return len(self._offsets) - 1
+
+    def _line(self, index):
+        if index in self.edits:
+            return self.edits[index]
+
+        start, end = self._offsets[index], self._offsets[index + 1] - 1
+        return self.mapped[start:end].rstrip(b"\r").decode()
+
+    def _index(self, index):
+        self._split(index)
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self._offsets) - 1:
+            raise IndexError("line index out of range")
+
+        return index
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        return self._line(self._index(index))
+
+    def __setitem__(self, index, line):
+        self.edits[self._index(index)] = line
+
+    def __iter__(self):
+        index = 0
+        while True:
+            self._split(index)
+            if index >= len(self._offsets) - 1:
+                return
+
+            yield self._line(index)
+            index += 1
+
+    def head(self):
+        """Get the bytes of the lines up to the last one edited, as they
+        are and as they have been edited. Edited lines keep the line
+        ending they had.
+
+        :return: Tuple of the old and new bytes.
+        """
+        end = max(self.edits, default=-1) + 1
+        old = self.mapped[: min(self._offsets[end], len(self.mapped))]
+        new = []
+        for i in range(end):
+            line = self.mapped[self._offsets[i] : self._offsets[i + 1]]
+            if i in self.edits:
+                ending = line[len(line.rstrip(b"\r\n")) :]
+                line = self.edits[i].encode() + ending
+
+            new.append(line)
+
+        return old, b"".join(new)
+
+    def close(self):
+        """Unmap the file."""
+        if not isinstance(self.mapped, bytes):
+            self.mapped.close()
+
+
+class AtomicWrite:
+    """Write a file through a temporary file beside it which only
+    replaces the file once it has been written in full, so a write that
+    fails part way leaves the file as it was. The temporary file is made
+    with ``tempfile.mkstemp`` so writers running at once each have their
+    own, and it is removed if the write fails.
+
+    The file keeps its mode, or gets the usual mode for a new file, and
+    its directory is made if need be.
+
+    :param path:    Path to the file.
+    :param mode:    ``"w"`` for text or ``"wb"`` for bytes.
+    """
+
+    def __init__(self, path, mode="w"):
+        self.path = path
+        self.mode = mode
+        self._tmp = None
+        self._file = None
+
+    def __enter__(self):
+        dirname, basename = os.path.split(self.path)
+        dirname = dirname or os.curdir
+        os.makedirs(dirname, exist_ok=True)
+        fd, self._tmp = tempfile.mkstemp(
+            prefix=f".{basename}.", suffix=".tmp", dir=dirname
+        )
+        self._file = os.fdopen(fd, self.mode)
+        return self._file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self._file.close()
+            if exc_type is None:
+                try:
+                    mode = os.stat(self.path).st_mode & 0o7777
+
+                except FileNotFoundError:
+                    umask = os.umask(0)
+                    os.umask(umask)
+                    mode = 0o666 & ~umask
+
+                os.chmod(self._tmp, mode)
+                os.replace(self._tmp, self.path)
+
+        finally:
+            if os.path.exists(self._tmp):
+                os.remove(self._tmp)
+
+
 class TextIO:
-    """Input / output for the selected path."""
+    """Input / output for the selected path.
 
-    def __init__(self, path):
+    Lines that are the same as what was read are not written, so the
+    file keeps its mtime, and a write goes to a temporary file which
+    then replaces the path, so the file is never left half written.
+
+    A lazy ``TextIO`` maps the file into memory instead of reading it,
+    and only splits it into ``lines`` as far as they are used. Writing
+    after editing lines near the start of the file only encodes those
+    lines. If they are the same length as before they are written over
+    the old ones in place, otherwise they are followed by a copy of the
+    rest of the file, written through a temporary file as above.
+
+    :param path: Path to the file.
+    :param lazy: Map the file instead of reading it.
+    """
+
+    def __init__(self, path, lazy=False):
         self.path = path
+        self.lazy = lazy
         self.lines = []
+        self.content = None
+        self.existed = os.path.isfile(path)
+        self.changed = False
         self.read()
 
     def read(self):
         """read files into buffer."""
-        if os.path.isfile(self.path):
+        if self.lazy:
+            if isinstance(self.lines, _Lines):
+                self.lines.close()
+
+            self.lines = _Lines(self._map())
+
+        elif os.path.isfile(self.path):
             with open(self.path) as file:
-                fin = file.read()
-                self.lines.extend(fin.splitlines())
+                self.content = file.read()
+                self.lines.extend(self.content.splitlines())
+
+    def _map(self):
+        if not os.path.isfile(self.path) or not os.path.getsize(self.path):
+            return b""
+
+        with open(self.path, "rb") as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _patch(self):
+        # write edited lines of a lazy ``TextIO`` over the start of the
+        # file
+        old, new = self.lines.head()
+        if old == new:
+            return False
+
+        path = os.path.realpath(self.path)
+        if len(old) == len(new):
+            with open(path, "r+b") as file:
+                file.write(new)
+                file.flush()
+                os.fsync(file.fileno())
+
+        else:
+            with AtomicWrite(path, "wb") as file:
+                file.write(new)
+                with memoryview(self.lines.mapped) as view:
+                    file.write(view[len(old) :])
+
+        self.changed = True
+        self.read()
+        return True
 
     def sort(self):
         """Sort the list of lines from file."""
@@ -76,15 +365,31 @@ class TextIO:
 
     def write(self, *lines):
         """Write list to file, overwriting any text that is already
-        written.
+        written, unless it is the same.
 
-        :param lines: Tuple of strings
+        :param lines:   Tuple of strings
+        :return:        True if the file was written, else False.
         """
         if lines:
             self.lines = list(lines)
-        with open(self.path, "w") as file:
-            for line in self.lines:
-                file.write(f"{line}\n")
+        if isinstance(self.lines, _Lines):
+            return self._patch()
+
+        content = "".join(f"{line}\n" for line in self.lines)
+        if self.content is None and self.lazy and os.path.isfile(self.path):
+            with open(self.path) as file:
+                self.content = file.read()
+
+        if content == self.content:
+            return False
+
+        # replace what a symlink points to rather than the symlink
+        with AtomicWrite(os.path.realpath(self.path)) as file:
+            file.write(content)
+
+        self.content = content
+        self.changed = True
+        return True
 
     def append(self, *lines):
         """write buffer back to file after any text that is already
@@ -92,16 +397,18 @@ class TextIO:
 
         :param lines: Tuple of strings
         """
-        self.lines.extend(lines)
+        self.lines = [*self.lines, *lines]
         self.write()
 
     def deduplicate(self):
-        """Remove duplicate entries in list."""
-        newlines = []
-        for line in self.lines:
-            if line not in newlines:
-                newlines.append(line)
-        self.lines = newlines
+        """Remove duplicate entries in list, keeping the first of each
+        in order.
+        """
+        self.lines = list(dict.fromkeys(self.lines))
+
+    def sort_unique(self):
+        """Sort the list of lines and remove duplicates in one pass."""
+        self.lines = sorted(set(self.lines))
 
 
 class MaxSizeList(list):
@@ -125,71 +432,331 @@ class MaxSizeList(list):
         super().append(element)
 
 
+class HashCache:
+    """Digests of files kept across runs, shared by every tool, so that
+    a file which has not changed is not hashed again.
+
+    A digest is used while the file's size, mtime and inode are the same
+    as when it was hashed, and its mtime was over a second older than
+    that. Only the ``maxsize`` most recently used are kept.
+
+    :param path:    Path to the cache, ``HASHCACHE`` in ``CONFIGDIR`` if
+                    None.
+    :param maxsize: Maximum number of digests to keep.
+    :param defer:   Only write the cache when ``write`` is called,
+                    rather than whenever a digest is added.
+    """
+
+    def __init__(self, path=None, maxsize=4096, defer=False):
+        self.path = path
+        self.maxsize = maxsize
+        self.defer = defer
+        self._entries = None
+
+    @property
+    def entries(self):
+        """Digests keyed by algorithm and path, least recently used
+        first, read the first time they are needed.
+        """
+        if self._entries is None:
+            if self.path is None:
+                self.path = os.path.join(_lazy("CONFIGDIR"), HASHCACHE)
+
+            try:
+                with open(self.path) as fin:
+                    self._entries = json.load(fin)
+
+            except (OSError, ValueError):
+                self._entries = {}
+
+        return self._entries
+
+    def get(self, path, algorithm, stat):
+        """Get the digest of a file if it has not changed since.
+
+        :param path:        Path to the file.
+        :param algorithm:   Algorithm the file was hashed with.
+        :param stat:        Tuple of the file's size, mtime and inode.
+        :return:            Digest, or None if there is none to use.
+        """
+        key = f"{algorithm}:{os.path.abspath(path)}"
+        entry = self.entries.pop(key, None)
+
+        # a file written within a second of being hashed could have
+        # changed again since without its mtime showing it
+        if (
+            entry is None
+            or tuple(entry[:3]) != tuple(stat)
+            or entry[3] - stat[1] <= 1_000_000_000
+        ):
+            return None
+
+        self.entries[key] = entry
+        return entry[4]
+
+    def put(self, path, algorithm, stat, digest, hashed):
+        """Keep the digest of a file, evicting the least recently used
+        past ``maxsize``, and write the cache unless deferred.
+
+        :param path:        Path to the file.
+        :param algorithm:   Algorithm the file was hashed with.
+        :param stat:        Tuple of the file's size, mtime and inode.
+        :param digest:      Digest of the file.
+        :param hashed:      Time in nanoseconds the file was hashed,
+                            from before it was read.
+        """
+        key = f"{algorithm}:{os.path.abspath(path)}"
+        self.entries.pop(key, None)
+        self.entries[key] = [*stat, hashed, digest]
+        while len(self.entries) > self.maxsize:
+            del self.entries[next(iter(self.entries))]
+
+        if not self.defer:
+            self.write()
+
+    def write(self):
+        """Write the cache atomically."""
+        entries = self.entries
+        with AtomicWrite(self.path) as fout:
+            json.dump(entries, fout)
+
+
 class HashCap:
     """Analyze hashes for before and after. ``self.snapshot``, the
     ``list`` object, only holds a maximum of two snapshots for before
     and after.
 
-    :param path: The path of the file to hash.
+    Files are hashed in chunks, so memory use does not grow with their
+    size, and not at all when their stat data already settles the
+    comparison: a file with the same size, mtime and inode as the last
+    snapshot keeps its digest, unless its mtime is within a second of
+    when it was hashed, and one whose size changed is recorded as
+    changed with None. A snapshot of None never compares equal.
+
+    :param path:        The path of the file to hash.
+    :param algorithm:   One of ``ALGORITHMS``. xxhash needs the
+                        ``xxhash`` package.
+    :param cache:       ``HashCache`` to look digests up in and add them
+                        to, if any.
     """
 
-    def __init__(self, path):
+    ALGORITHMS = ("blake2b", "sha256", "md5", "xxhash")
+    CHUNK = 1 << 20
+
+    def __init__(self, path, algorithm="blake2b", cache=None):
+        if algorithm not in self.ALGORITHMS:
+            raise ValueError(f"unsupported algorithm: {algorithm}")
+
         self.path = path
+        self.algorithm = algorithm
+        self.cache = cache
         self.snapshot = MaxSizeList(maxlen=2)
+        self.stat = MaxSizeList(maxlen=2)
+        self.hashed = None
+
+    def _new(self):
+        if self.algorithm == "xxhash":
+            try:
+                import xxhash
+
+            except ImportError as err:
+                raise ImportError("xxhash needs the xxhash package") from err
+
+            return xxhash.xxh3_128()
+
+        import hashlib
+
+        return hashlib.new(self.algorithm)
+
+    def digest(self):
+        """Hash the file a chunk at a time.
+
+        :return: Hex digest of the file.
+        """
+        hashobj = self._new()
+        buffer = bytearray(self.CHUNK)
+        view = memoryview(buffer)
+        with open(self.path, "rb", buffering=0) as fin:
+            for size in iter(lambda: fin.readinto(buffer), 0):
+                hashobj.update(view[:size])
+
+        return hashobj.hexdigest()
 
     def hash_file(self):
-        """Open the files and inspect it to get its hash. Return the
-        hash as a string.
+        """Open the files and inspect it to get its hash. Append the
+        hash as a string to ``snapshot``, or None if the file's size
+        shows it changed since the last snapshot.
         """
-        with open(self.path, "rb") as lines:
-            # noinspection InsecureHash
-            md5_hash = hashlib.md5(lines.read())
-            self.snapshot.append(md5_hash.hexdigest())
+        stat = os.stat(self.path)
+        stat = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        if self.stat and self.stat[-1][0] != stat[0]:
+            digest = None
+
+        # a file written within a second of being hashed could have
+        # changed again since without its mtime showing it
+        elif (
+            self.stat
+            and self.stat[-1] == stat
+            and self.snapshot[-1] is not None
+            and self.hashed - stat[1] > 1_000_000_000
+        ):
+            digest = self.snapshot[-1]
+
+        else:
+            self.hashed = time.time_ns()
+            digest = None
+            if self.cache is not None:
+                digest = self.cache.get(self.path, self.algorithm, stat)
+
+            if digest is None:
+                digest = self.digest()
+                if self.cache is not None:
+                    self.cache.put(
+                        self.path, self.algorithm, stat, digest, self.hashed
+                    )
+
+        self.stat.append(stat)
+        self.snapshot.append(digest)
 
     def compare(self):
         """Compare two hashes in the ``snapshot`` list.
 
         :return:    Boolean: True for both match, False if they don't.
         """
-        return self.snapshot[0] == self.snapshot[1]
+        return None not in self.snapshot and (
+            self.snapshot[0] == self.snapshot[1]
+        )
+
+
+def _gitignore(path, base):
+    # rules of the ``.gitignore`` in ``path``, which is ``base`` relative
+    # to where the search started
+    rules = []
+    try:
+        with open(os.path.join(path, ".gitignore")) as file:
+            lines = file.read().splitlines()
+
+    except OSError:
+        return rules
+
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        negate = line.startswith("!")
+        dironly = line.endswith("/")
+        pattern = line.lstrip("!").rstrip("/")
+
+        # a pattern without a slash, other than a trailing one, matches
+        # at any depth, as one starting with ``**/`` does
+        parts = pattern.lstrip("/").split("/")
+        if "/" not in pattern:
+            parts.insert(0, "**")
+
+        rules.append((base, parts, dironly, negate))
+
+    return rules
+
+
+def _match(names, parts):
+    # path segments against pattern segments, where ``**`` matches any
+    # number of segments and the rest match one each, so ``*`` never
+    # matches a slash
+    if not parts:
+        return not names
+
+    if parts[0] == "**":
+        return any(
+            _match(names[i:], parts[1:]) for i in range(len(names) + 1)
+        )
+
+    return (
+        bool(names)
+        and fnmatch.fnmatchcase(names[0], parts[0])
+        and _match(names[1:], parts[1:])
+    )
+
+
+def _ignored(rules, rel, isdir):
+    # the last rule to match wins, so a negated one can un-ignore
+    ignored = False
+    for base, parts, dironly, negate in rules:
+        if dironly and not isdir:
+            continue
+
+        sub = rel
+        if base:
+            if not rel.startswith(base + "/"):
+                continue
+
+            sub = rel[len(base) + 1 :]
 
+        if _match(sub.split("/"), parts):
+            ignored = not negate
 
-def iter_repo(path):
+    return ignored
+
+
+def iter_repo(path, max_depth=None, ignore=True):
     """Trawl through the project directories to find the dirname
     containing ``__main__.py``
 
-    :param path:    The first path argument parsed with
-                    ``argparse.ArgumentParser`` from the commandline and
-                    then all built paths following through recursion
-                    when this function calls itself
-    :return:        A directory name which contains ``__main__.py`` or
-                    ``None``
+    The search is breadth first, so the shallowest package is found,
+    and never enters ``.git``, virtual environments, symlinked
+    directories, or, if ``ignore`` is True, what the ``.gitignore``
+    files it passes ignore.
+
+    :param path:        The first path argument parsed with
+                        ``argparse.ArgumentParser`` from the commandline
+    :param max_depth:   Number of directories deep to search, or None
+                        for no limit
+    :param ignore:      Skip what ``.gitignore`` files ignore
+    :return:            ``path`` if it contains ``__main__.py`` or
+                        ``__init__.py``, else the name of the first
+                        directory which does or ``None``
     """
-    items = os.listdir(path)
-    if "__main__.py" in items or "__init__.py" in items:
-        return path
-    for item in items:
-        subpath = os.path.join(path, item)
-        if os.path.isdir(subpath):
-            returned_path = iter_repo(subpath)
-            if returned_path:
-                return os.path.basename(returned_path)
+    queue = collections.deque([(path, "", 0, [])])
+    while queue:
+        current, rel, depth, rules = queue.popleft()
+        try:
+            with os.scandir(current) as items:
+                entries = sorted(items, key=lambda e: e.name)
+
+        except OSError:
+            continue
+
+        names = {e.name for e in entries}
+        if "__main__.py" in names or "__init__.py" in names:
+            return path if current == path else os.path.basename(current)
+
+        if "pyvenv.cfg" in names or depth == max_depth:
+            continue
+
+        if ignore:
+            rules = rules + _gitignore(current, rel)
+
+        for entry in entries:
+            if entry.name == ".git" or not entry.is_dir(follow_symlinks=False):
+                continue
+
+            sub = f"{rel}/{entry.name}" if rel else entry.name
+            if not _ignored(rules, sub, True):
+                queue.append((entry.path, sub, depth + 1, rules))
+
     return None
 
 
-def announce(hashcap, filename):
-    """Announce whether whitelist.py needed to be updated or not.
+def announce(textio, filename):
+    """Announce whether a file needed to be updated or not.
 
-    :param hashcap:     Instantiated ``HashCap`` object containing
-                        the ``snapshot`` list of file hashes.
+    :param textio:      ``TextIO`` object the file was written with.
     :param filename:    Name of the file without the preceding paths.
     """
     output = f"created `{filename}'"
-    if hashcap.snapshot:
+    if textio.existed:
         output = f"updated `{filename}'"
-        hashcap.hash_file()
-        match = hashcap.compare()
-        if match:
+        if not textio.changed:
             output = f"`{filename}' is already up to date"
     print(output)
 
@@ -202,6 +769,8 @@ def pipe_command(command, *args):
     :param args:    Args to be run by the command.
     :return:        Output piped from the command as a ``str`` object.
     """
+    import subprocess
+
     process = subprocess.Popen([command, *args], stdout=subprocess.PIPE)
     stdout = process.communicate()[0]
     return stdout.decode().splitlines()
@@ -211,28 +780,89 @@ class Index:
     """Get all the directories in the notebook repository as a list
     object of all absolute paths
 
+    Directories are listed with ``os.scandir`` and the modules and
+    subdirectories each one holds are cached with its mtime, which
+    changes whenever an entry in it is added, removed or renamed, so a
+    directory which has not changed is only stat-ed, not listed.
+
     :param root:        The root directory which the class will walk
+    :param cache:       Path to the cache, ``INDEXCACHE`` in
+                        ``CONFIGDIR`` if None
     """
 
-    def __init__(self, root):
+    def __init__(self, root, cache=None):
         self._root = root
+        self._cache = cache
         self.file_paths = []
 
-    def walk_files(self, root, files):
-        """Walk through the notes directory structure and perform
-        variable actions on directory files specifically
+    @staticmethod
+    def _listing(path, cached):
+        # modules and subdirectories of ``path``, listed again unless its
+        # mtime is the cached one and was over a second older than the
+        # listing, as an entry added within the mtime's granularity of
+        # the listing would not have changed it
+        mtime = os.stat(path).st_mtime_ns
+        if (
+            cached is not None
+            and cached[0] == mtime
+            and cached[3] - mtime > 1_000_000_000
+        ):
+            return cached
+
+        files, dirs = [], []
+        with os.scandir(path) as items:
+            for item in items:
+                if item.is_dir(follow_symlinks=False):
+                    dirs.append(item.name)
+
+                elif item.name.endswith(".py") and item.name not in (
+                    "__main__.py",
+                    "__init__.py",
+                ):
+                    files.append(item.name)
 
-        :param root:    Top level of directory structure
-        :param files:   List of files within directory structure
+        return [mtime, sorted(files), sorted(dirs), time.time_ns()]
+
+    def modules(self):
+        """Yield the dotted name of every module under the root
+        directory, other than ``__main__`` and ``__init__``, as it is
+        found, and update the cache once all have been.
+
+        :return: Generator of module names.
         """
-        for file in files:
-            fullpath = os.path.join(root, file)
-            if fullpath.endswith(".py") and os.path.basename(fullpath) not in (
-                "__main__.py",
-                "__init__.py",
-            ):
-                module = fullpath.replace(os.sep, ".").replace(".py", "")
-                self.file_paths.append(module)
+        if not os.path.isdir(self._root):
+            return
+
+        path = self._cache
+        if path is None:
+            path = os.path.join(_lazy("CONFIGDIR"), INDEXCACHE)
+
+        try:
+            with open(path) as fin:
+                caches = json.load(fin)
+
+        except (OSError, ValueError):
+            caches = {}
+
+        key = os.path.abspath(self._root)
+        cached = caches.get(key, {})
+        listings = {}
+        stack = [""]
+        while stack:
+            rel = stack.pop()
+            current = os.path.join(self._root, rel)
+            listing = self._listing(current, cached.get(rel))
+            listings[rel] = listing
+            for file in listing[1]:
+                module = os.path.join(current, file[: -len(".py")])
+                yield module.replace(os.sep, ".")
+
+            stack.extend(os.path.join(rel, d) for d in reversed(listing[2]))
+
+        if listings != cached:
+            caches[key] = listings
+            with AtomicWrite(path) as fout:
+                json.dump(caches, fout)
 
     def walk_dirs(self):
         """Iterate through walk if the root directory exists
@@ -242,53 +872,554 @@ class Index:
         - forget about the directories returned by walk
         - Once files are determined perform the required actions
         """
-        if os.path.isdir(self._root):
-            for root, _, files in os.walk(self._root):
-                self.walk_files(root, files)
+        self.file_paths.extend(self.modules())
+
+
+class GzipMembers:
+    """Write-only file object that gzips what is written to it in
+    blocks, each one an independent gzip member, on a pool of threads.
+    Concatenated members are a standard gzip stream that ``gzip`` and
+    ``tar`` read as one, and each one is a point where reading can
+    start without decompressing what came before it.
+
+    :param fileobj: Binary file object to write the members to.
+    :param level:   Compression level.
+    :param jobs:    Number of blocks to compress at once.
+    :param block:   Uncompressed size of each member.
+    """
+
+    def __init__(self, fileobj, level=9, jobs=1, block=1 << 20):
+        import concurrent.futures
+
+        self.fileobj = fileobj
+        self.level = level
+        self.jobs = jobs
+        self.block = block
+        self.offsets = []
+        self._written = 0
+        self._buffer = bytearray()
+        self._pending = collections.deque()
+        self._executor = concurrent.futures.ThreadPoolExecutor(jobs)
+
+    def _compress(self, data):
+        return gzip.compress(data, self.level, mtime=0)
+
+    def _submit(self, data):
+        self._pending.append(self._executor.submit(self._compress, data))
+
+        # keep memory bounded and the pool busy
+        while len(self._pending) > self.jobs * 2:
+            self._write(self._pending.popleft().result())
+
+    def _write(self, member):
+        self.offsets.append(self._written)
+        self._written += self.fileobj.write(member)
+
+    def write(self, data):
+        """Buffer data and compress every full block.
+
+        :param data:    Bytes to write.
+        :return:        Number of bytes written.
+        """
+        self._buffer += data
+        while len(self._buffer) >= self.block:
+            self._submit(bytes(self._buffer[: self.block]))
+            del self._buffer[: self.block]
+
+        return len(data)
+
+    def close(self):
+        """Compress what is left and write every member in order."""
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+
+            while self._pending:
+                self._write(self._pending.popleft().result())
+
+        finally:
+            self._executor.shutdown()
+
+
+def _zstandard():
+    try:
+        import zstandard
+
+    except ImportError as err:
+        raise ImportError("zst archives need the zstandard package") from err
+
+    return zstandard
+
+
+class _Extractor:
+    """Write members read from a tar stream under a directory. Regular
+    files up to ``SMALL`` bytes are read whole and written on a pool of
+    threads so that decompressing the archive overlaps with writing
+    them. Larger ones are copied to disk in chunks as they are read, so
+    memory stays bounded however big the members are.
+
+    Every member goes through ``tarfile``'s data filter, which refuses
+    ones that would land outside ``dest``, such as absolute paths,
+    ``..`` and links pointing out of it, as well as device files, and
+    drops ownership and unsafe modes.
+
+    :param dest:    Directory to extract into.
+    :param jobs:    Number of files to write at once.
+    """
+
+    SMALL = 1 << 20
+
+    def __init__(self, dest, jobs=1):
+        import concurrent.futures
+
+        self.dest = os.path.realpath(dest)
+        self.jobs = jobs
+        self.size = 0
+        self._dirs = []
+        self._pending = collections.deque()
+        self._executor = concurrent.futures.ThreadPoolExecutor(jobs)
+        os.makedirs(self.dest, exist_ok=True)
+
+    def _filter(self, tarinfo):
+        import tarfile
+
+        if hasattr(tarfile, "data_filter"):
+            return tarfile.data_filter(tarinfo, self.dest)
+
+        # the same checks for Pythons without extraction filters
+        path = os.path.join(self.dest, tarinfo.name)
+        paths = [path]
+        if tarinfo.issym():
+            paths.append(os.path.join(os.path.dirname(path), tarinfo.linkname))
+
+        elif tarinfo.islnk():
+            paths.append(os.path.join(self.dest, tarinfo.linkname))
+
+        elif not tarinfo.isreg() and not tarinfo.isdir():
+            raise tarfile.TarError(f"{tarinfo.name} is a special file")
+
+        for path in paths:
+            path = os.path.realpath(path)
+            if os.path.commonpath([self.dest, path]) != self.dest:
+                raise tarfile.TarError(f"{tarinfo.name} is outside the dest")
+
+        tarinfo.mode &= 0o755
+        tarinfo.uid = tarinfo.gid = tarinfo.uname = tarinfo.gname = None
+        return tarinfo
+
+    @staticmethod
+    def _write(path, fileobj, tarinfo):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fout:
+            shutil.copyfileobj(fileobj, fout)
+
+        os.chmod(path, tarinfo.mode)
+        os.utime(path, (tarinfo.mtime, tarinfo.mtime))
+
+    def _wait(self, pending=0):
+        # raises the first error from a write
+        while len(self._pending) > pending:
+            self._pending.popleft().result()
+
+    def add(self, tar, tarinfo):
+        """Extract the member which ``tar`` has just read.
+
+        :param tar:     ``TarFile`` the member is read from.
+        :param tarinfo: ``TarInfo`` of the member.
+        """
+        import tarfile
+
+        tarinfo = self._filter(tarinfo)
+        path = os.path.join(self.dest, tarinfo.name)
+        if tarinfo.isreg():
+            fileobj = tar.extractfile(tarinfo)
+            self.size += tarinfo.size
+            if tarinfo.size > self.SMALL:
+                self._write(path, fileobj, tarinfo)
+                return
+
+            data = io.BytesIO(fileobj.read())
+            self._pending.append(
+                self._executor.submit(self._write, path, data, tarinfo)
+            )
+
+            # keep memory bounded and the pool busy
+            self._wait(self.jobs * 2)
+
+        elif tarinfo.isdir():
+            os.makedirs(path, exist_ok=True)
+            self._dirs.append(tarinfo)
+
+        else:
+            # links may point to files which are still being written
+            self._wait()
+            kwargs = {}
+            if hasattr(tarfile, "data_filter"):
+                kwargs["filter"] = "fully_trusted"
+
+            tar.extract(tarinfo, self.dest, **kwargs)
+
+    def close(self):
+        """Wait for every file to be written, then set the modes and
+        times of directories, deepest first, which writing into them
+        would have changed.
+
+        :return: Number of bytes extracted.
+        """
+        try:
+            self._wait()
+
+        finally:
+            self._executor.shutdown()
+
+        for tarinfo in reversed(self._dirs):
+            path = os.path.join(self.dest, tarinfo.name)
+            if tarinfo.mode is not None:
+                os.chmod(path, tarinfo.mode)
+
+            os.utime(path, (tarinfo.mtime, tarinfo.mtime))
+
+        return self.size
 
 
 class Tar:
-    def __init__(self, file, archive):
+    """Create and extract tar archives.
+
+    :param file:    File or directory to archive.
+    :param archive: Path to the archive.
+    :param codec:   One of ``CODECS``, worked out from the extension of
+                    ``archive`` if None.
+    :param level:   Compression level, or None for the codec's default.
+    :param jobs:    Number of threads to compress and to write extracted
+                    files with. gz archives are written as independent
+                    gzip members, compressed in parallel for more than
+                    one.
+    :param members: Paths relative to ``file`` to add one by one,
+                    without recursing, instead of all of ``file``.
+    """
+
+    CODECS = {
+        "gz": ".tar.gz",
+        "bz2": ".tar.bz2",
+        "xz": ".tar.xz",
+        "zst": ".tar.zst",
+        "none": ".tar",
+    }
+
+    def __init__(
+        self, file, archive, codec=None, level=None, jobs=1, members=None
+    ):
         self.file = file
         self.archive = archive
+        self.codec = self.guess_codec(archive) if codec is None else codec
+        self.level = level
+        self.jobs = jobs
+        self.members = members
+        if self.codec not in self.CODECS:
+            raise ValueError(f"unsupported codec: {self.codec}")
+
+    @classmethod
+    def guess_codec(cls, archive):
+        """Work out the codec from the archive's extension.
+
+        :param archive: Path to the archive.
+        :return:        Codec, "gz" if the extension is not known.
+        """
+        for codec, ext in cls.CODECS.items():
+            if archive.endswith(ext):
+                return codec
+
+        return "gz"
 
-    def _compress_dir(self, tar):
+    def _compress_dir(self, tar, record):
         dircontents = [
             os.path.join(self.file, i) for i in os.listdir(self.file)
         ]
 
         for content in dircontents:
-            tar.add(content)
+            tar.add(content, filter=record)
+
+    def _add(self, tar):
+        offsets = {}
+
+        def record(tarinfo):
+            # called before each member is written, with ``tar.offset``
+            # where its header will start in the uncompressed stream
+            offsets[tarinfo.name] = tar.offset
+            return tarinfo
+
+        if self.members is not None:
+            for member in self.members:
+                tar.add(
+                    os.path.join(self.file, member),
+                    recursive=False,
+                    filter=record,
+                )
+
+        elif os.path.isdir(self.file):
+            self._compress_dir(tar, record)
+
+        elif os.path.isfile(self.file):
+            tar.add(self.file, filter=record)
+
+        return offsets
+
+    def _stream(self, fileobj):
+        # compressing file object that leaves ``fileobj`` open on close
+        level = self.level
+        if self.codec == "gz":
+            return GzipMembers(
+                fileobj, 9 if level is None else level, self.jobs
+            )
+
+        if self.codec == "bz2":
+            return bz2.BZ2File(
+                fileobj, "wb", compresslevel=9 if level is None else level
+            )
+
+        if self.codec == "xz":
+            return lzma.LZMAFile(fileobj, "wb", preset=level)
+
+        if self.codec == "zst":
+            compressor = _zstandard().ZstdCompressor(
+                level=3 if level is None else level,
+                threads=self.jobs if self.jobs > 1 else 0,
+            )
+            return compressor.stream_writer(fileobj, closefd=False)
+
+        return fileobj
+
+    @property
+    def index(self):
+        """Path to the index written beside the archive."""
+        return self.archive + ".idx"
+
+    def compress(self, fileobj=None):
+        """Write the archive as a stream, so that it can be written
+        straight into a pipe as well as to ``archive``.
+
+        Archives written to ``archive`` as gz or uncompressed get an
+        index beside them of where each member starts, and for gz of
+        where each gzip member starts, so that ``extract`` can seek
+        straight to the members it is asked for.
+
+        :param fileobj: Binary file object to write the archive to
+                        instead of ``archive``.
+        """
+        if fileobj is None:
+            with open(self.archive, "wb") as fout:
+                offsets, stream = self._write(fout)
+
+            if self.codec in ("gz", "none"):
+                with open(self.index, "w") as fout:
+                    json.dump(
+                        {
+                            "block": getattr(stream, "block", None),
+                            "restarts": getattr(stream, "offsets", None),
+                            "members": offsets,
+                        },
+                        fout,
+                    )
+
+            return
+
+        self._write(fileobj)
+
+    def _write(self, fileobj):
+        import tarfile
+
+        stream = self._stream(fileobj)
+        try:
+            with tarfile.open(fileobj=stream, mode="w|") as tar:
+                offsets = self._add(tar)
+
+        finally:
+            if stream is not fileobj:
+                stream.close()
 
-    def compress(self):
-        with tarfile.open(self.archive, "w:gz") as tar:
+        return offsets, stream
 
-            if os.path.isdir(self.file):
-                self._compress_dir(tar)
+    @staticmethod
+    def _wanted(name, members, include, exclude):
+        if members is not None and not (
+            name in members
+            or any(name.startswith(m.rstrip("/") + "/") for m in members)
+        ):
+            return False
 
-            elif os.path.isfile(self.file):
-                tar.add(self.file)
+        if include is not None and not any(
+            fnmatch.fnmatch(name, p) for p in include
+        ):
+            return False
 
-    def extract(self):
-        with tarfile.open(self.archive) as tar:
-            tar.extractall()
+        return not any(fnmatch.fnmatch(name, p) for p in exclude or ())
+
+    def _seek(self, fin, offset, index):
+        # uncompressed stream positioned at ``offset``, starting from the
+        # nearest gzip member before it
+        if self.codec == "none":
+            fin.seek(offset)
+            return fin
+
+        block = index["block"]
+        fin.seek(index["restarts"][offset // block])
+        stream = gzip.GzipFile(fileobj=fin, mode="rb")
+        stream.read(offset % block)
+        return stream
+
+    def _extract_indexed(self, extractor, wanted):
+        import tarfile
+
+        with open(self.index) as fin:
+            index = json.load(fin)
+
+        offsets = sorted(v for k, v in index["members"].items() if wanted(k))
+        with open(self.archive, "rb") as fin:
+            for offset in offsets:
+                stream = self._seek(fin, offset, index)
+                with tarfile.open(fileobj=stream, mode="r|") as tar:
+                    extractor.add(tar, tar.next())
+
+    def _extract_stream(self, extractor, wanted, fileobj):
+        import tarfile
+
+        magic = fileobj.peek(4)[:4]
+        if magic == b"\x28\xb5\x2f\xfd":
+            fileobj = _zstandard().ZstdDecompressor().stream_reader(fileobj)
+
+        # tarfile's own gzip stream stops after the first member
+        elif magic[:2] == b"\x1f\x8b":
+            fileobj = gzip.GzipFile(fileobj=fileobj, mode="rb")
+
+        with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+            for tarinfo in tar:
+                if wanted(tarinfo.name):
+                    extractor.add(tar, tarinfo)
+
+    def extract(
+        self, fileobj=None, members=None, dest=".", include=None, exclude=None
+    ):
+        """Extract the archive as a stream, so that it can be read
+        straight from a pipe as well as from ``archive``.
+
+        Members which would be written outside ``dest`` are refused, and
+        files are written on ``jobs`` threads.
+
+        :param fileobj: Buffered binary file object to read the archive
+                        from instead of ``archive``.
+        :param members: Names of members in the archive to extract,
+                        along with what is under them, instead of all of
+                        them. If the archive has an index only these are
+                        read.
+        :param dest:    Directory to extract into.
+        :param include: Glob patterns, one of which names of members
+                        to extract must match.
+        :param exclude: Glob patterns which names of members to extract
+                        must not match.
+        :return:        Number of bytes extracted.
+        """
+        extractor = _Extractor(dest, self.jobs)
+
+        def wanted(name):
+            return self._wanted(name, members, include, exclude)
+
+        try:
+            if fileobj is not None:
+                self._extract_stream(extractor, wanted, fileobj)
+
+            elif members is not None and os.path.isfile(self.index):
+                self._extract_indexed(extractor, wanted)
+
+            else:
+                with open(self.archive, "rb") as fin:
+                    self._extract_stream(extractor, wanted, fin)
+
+        finally:
+            size = extractor.close()
+
+        return size
 
 
 class Yaml:
+    """Read and write yaml files.
+
+    Parsed files are cached beside them, keyed by the file's mtime,
+    size and hash, so a file that has not changed is loaded from the
+    cache without being parsed. The mtime and size alone are only
+    trusted once the mtime is over a second older than the cache, as an
+    edit within the mtime's granularity would not change it, otherwise
+    the file is hashed. libyaml is used when it is available.
+
+    :param path: Path to the yaml file.
+    """
+
     def __init__(self, path):
         super().__init__()
         self.path = path
         self.dir = os.path.dirname(path)
+        self.cache = os.path.join(self.dir, f".{os.path.basename(path)}.cache")
         self.exists = os.path.isfile(self.path)
         self.dict = {}
 
     def write(self):
+        import yaml
+
         if os.path.isdir(self.dir):
             with open(self.path, "w") as fout:
-                yaml.dump(self.dict, fout)
+                yaml.dump(
+                    self.dict,
+                    fout,
+                    Dumper=getattr(yaml, "CDumper", yaml.Dumper),
+                )
             self.exists = True
 
+    def _read_cache(self):
+        try:
+            with open(self.cache, "rb") as fin:
+                key, obj = marshal.load(fin)
+
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+        # caches written before the time was recorded are not trusted
+        return (key, obj) if len(key) == 4 else None
+
+    def _write_cache(self, key, obj):
+        try:
+            with open(self.cache, "wb") as fout:
+                marshal.dump((key, obj), fout)
+
+        # nothing is lost if the conf cannot be cached
+        except (OSError, ValueError):
+            pass
+
     def read(self):
         if self.exists:
-            with open(self.path) as fin:
-                self.dict.update(yaml.safe_load(fin))
+            stat = os.stat(self.path)
+            cached = self._read_cache()
+            key = [stat.st_mtime_ns, stat.st_size, None, time.time_ns()]
+            if (
+                cached is not None
+                and cached[0][:2] == key[:2]
+                and cached[0][3] - cached[0][0] > 1_000_000_000
+            ):
+                self.dict.update(cached[1])
+                return
+
+            import hashlib
+
+            with open(self.path, "rb") as fin:
+                content = fin.read()
+
+            key[2] = hashlib.blake2b(content).hexdigest()
+            if cached is not None and cached[0][2] == key[2]:
+                obj = cached[1]
+            else:
+                import yaml
+
+                loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+                obj = yaml.load(content, Loader=loader) or {}
+
+            self._write_cache(key, obj)
+            self.dict.update(obj)
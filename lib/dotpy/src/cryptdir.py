@@ -2,9 +2,13 @@
 cryptdir
 """
 import argparse
+import concurrent.futures
+import glob
 import os
 import shutil
 import subprocess
+import tarfile
+import time
 
 from . import Tar
 
@@ -15,11 +19,26 @@ class Parser(argparse.ArgumentParser):
         self._add_arguments()
         self._args = self.parse_args()
         self.rec = self._args.rec
-        self.path = self._args.path
+        self.paths = self._expand(self._args.path)
+        self.decrypt = self._args.decrypt
+        self.jobs = self._args.jobs
+
+    @staticmethod
+    def _expand(patterns):
+        # globs the shell did not expand, e.g. when quoted
+        paths = []
+        for pattern in patterns:
+            paths.extend(sorted(glob.glob(pattern)) or [pattern])
+
+        return list(dict.fromkeys(p.rstrip(os.sep) or p for p in paths))
 
     def _add_arguments(self):
         self.add_argument(
-            "path", metavar="PATH", action="store", help="path to archive"
+            "path",
+            metavar="PATH",
+            action="store",
+            nargs="+",
+            help="paths or globs to archive",
         )
         self.add_argument(
             "-r",
@@ -27,49 +46,224 @@ class Parser(argparse.ArgumentParser):
             action="store",
             help="recipient key-holder",
         )
+        self.add_argument(
+            "-d",
+            "--decrypt",
+            action="store_true",
+            help="decrypt and extract an archive made by cryptdir",
+        )
+        self.add_argument(
+            "-j",
+            "--jobs",
+            action="store",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="number of paths to process at once",
+        )
 
 
 class GPG:
+    """Encrypt and decrypt archives with ``gpg``, streaming them through
+    its stdin and stdout so no plaintext archive is ever written.
+
+    :param file: Path to the archive, without the ``.gpg`` extension.
+    """
+
     def __init__(self, file):
         self._file = file
         self.enc = file + ".gpg"
 
-    def encrypt(self, recipient):
-        subprocess.call(
-            [
-                "gpg",
-                "-output",
-                self.enc,
-                "--encrypt",
-                self._file,
-                "--recipient",
-                recipient,
-            ]
+    def encrypt(self, recipient, tarobj):
+        """Archive straight into ``gpg``. If archiving fails ``gpg`` is
+        killed and what it wrote is removed.
+
+        :param recipient:   Recipient key-holder.
+        :param tarobj:      ``Tar`` object to compress.
+        :return:            Exit code of ``gpg``.
+        """
+        args = ["gpg", "--yes", "--output", self.enc, "--encrypt"]
+        if recipient is not None:
+            args.extend(["--recipient", recipient])
+
+        process = subprocess.Popen(args, stdin=subprocess.PIPE)
+        try:
+            tarobj.compress(process.stdin)
+            process.stdin.close()
+
+        except BaseException:
+            process.kill()
+            try:
+                process.stdin.close()
+
+            # anything left in the buffer has nowhere to go
+            except OSError:
+                pass
+
+            process.wait()
+            try:
+                os.remove(self.enc)
+
+            except FileNotFoundError:
+                pass
+
+            raise
+
+        return process.wait()
+
+    def decrypt(self, tarobj):
+        """Extract straight from ``gpg``. If extracting fails ``gpg`` is
+        killed.
+
+        :param tarobj:  ``Tar`` object to extract.
+        :return:        Tuple of the exit code of ``gpg`` and the number
+                        of bytes extracted.
+        """
+        process = subprocess.Popen(
+            ["gpg", "--decrypt", self.enc], stdout=subprocess.PIPE
         )
+        try:
+            size = tarobj.extract(process.stdout)
 
-    def decrypt(self):
-        subprocess.call(["gpg", "--decrypt", self.enc])
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
 
+        finally:
+            process.stdout.close()
 
-def main():
-    parser = Parser()
-    archive = parser.path + ".tar.gz"
+        return process.wait(), size
+
+
+def _size(path):
+    if os.path.isdir(path):
+        size = 0
+        for root, _, files in os.walk(path):
+            for file in files:
+                size += os.lstat(os.path.join(root, file)).st_size
+
+        return size
+
+    return os.path.getsize(path)
+
+
+def _human(size):
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+
+        size /= 1024
+
+    return f"{size:.1f} GiB"
+
+
+def encrypt(path, recipient):
+    """Archive and encrypt a path in one pass and then remove it.
+
+    :param path:        Path to archive.
+    :param recipient:   Recipient key-holder.
+    :return:            Tuple of bytes in, bytes out and the path of the
+                        encrypted archive.
+    """
+    archive = path + ".tar.gz"
+    gpg = GPG(archive)
+    size = _size(path)
+    if gpg.encrypt(recipient, Tar(path, archive)):
+        raise RuntimeError("gpg failed to encrypt " + path)
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+    return size, os.path.getsize(gpg.enc), gpg.enc
+
+
+def decrypt(path, _):
+    """Decrypt and extract an archive made by ``encrypt`` into the
+    current working directory.
+
+    :param path:    Path to the encrypted archive.
+    :return:        Tuple of bytes in, bytes out and where the archive
+                    was extracted to.
+    """
+    archive = path[: -len(".gpg")] if path.endswith(".gpg") else path
     gpg = GPG(archive)
+    returncode, size = gpg.decrypt(Tar(archive, archive))
+    if returncode:
+        raise RuntimeError("gpg failed to decrypt " + gpg.enc)
 
-    print("Compressing " + parser.path)
-    Tar(parser.path, archive)
-    print(". " + parser.path + " -> " + archive)
+    return os.path.getsize(gpg.enc), size, os.getcwd()
 
-    print("Removing " + parser.path)
-    shutil.rmtree(parser.path)
-    print(". removed " + parser.path)
 
-    print("Encrypting " + archive)
-    gpg.encrypt(parser.rec)
-    print(". " + archive + " -> " + gpg.enc)
+def _timed(func, path, recipient):
+    start = time.perf_counter()
+    return (*func(path, recipient), time.perf_counter() - start)
 
-    print("Removing " + archive)
-    os.remove(archive)
-    print(". removed " + archive)
 
-    print("Done")
+def run(func, paths, recipient, jobs):
+    """Process every path, up to ``jobs`` at once in a pool of
+    processes, as archiving and encrypting are both bound by the CPU.
+
+    :param func:        ``encrypt`` or ``decrypt``.
+    :param paths:       List of paths.
+    :param recipient:   Recipient key-holder.
+    :param jobs:        Number of paths to process at once.
+    :return:            Generator of the path and either the result of
+                        ``func`` with the time it took or the exception
+                        it raised, in the order they finish.
+    """
+    if jobs <= 1 or len(paths) == 1:
+        for path in paths:
+            try:
+                yield path, _timed(func, path, recipient)
+
+            except (OSError, RuntimeError, tarfile.TarError) as err:
+                yield path, err
+
+        return
+
+    workers = min(jobs, len(paths))
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = {
+            executor.submit(_timed, func, path, recipient): path
+            for path in paths
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                yield futures[future], future.result()
+
+            except (OSError, RuntimeError, tarfile.TarError) as err:
+                yield futures[future], err
+
+
+def main():
+    parser = Parser()
+    func = decrypt if parser.decrypt else encrypt
+    action = "Decrypting" if parser.decrypt else "Compressing and encrypting"
+    print(f"{action} {len(parser.paths)} path(s)")
+    start = time.perf_counter()
+    total_in = total_out = 0
+    failed = []
+    for path, result in run(func, parser.paths, parser.rec, parser.jobs):
+        if isinstance(result, Exception):
+            failed.append(path)
+            print(f". failed {path}: {result}")
+            continue
+
+        size_in, size_out, dest, seconds = result
+        total_in += size_in
+        total_out += size_out
+        print(
+            f". {path} -> {dest} "
+            f"({_human(size_in)} -> {_human(size_out)}, {seconds:.2f}s)"
+        )
+
+    done = len(parser.paths) - len(failed)
+    print(
+        f"Done: {done} ok, {len(failed)} failed, "
+        f"{_human(total_in)} -> {_human(total_out)} "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+    if failed:
+        raise SystemExit(1)
@@ -13,7 +13,7 @@ class EditTitle(TextIO):
     """
 
     def __init__(self, path, replace):
-        super().__init__(path)
+        super().__init__(path, lazy=True)
         self.path = path
         self.replace = replace
         self.underline = len(replace) * "="
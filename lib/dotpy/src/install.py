@@ -3,11 +3,31 @@ dotfiles.__init__
 =================
 """
 import argparse
+import concurrent.futures
+import datetime
+import hashlib
+import json
 import os
 import pathlib
+import re
+import shutil
+import threading
+import time
 
 
-from . import SUFFIX, CONFIG, HOME, CONFIGDIR, DOTCONTENTS, Yaml, comments
+from . import (
+    BACKUPS,
+    SUFFIX,
+    CONFIG,
+    HOME,
+    CONFIGDIR,
+    DOTCONTENTS,
+    JOURNAL,
+    STATE,
+    HashCap,
+    Yaml,
+    comments,
+)
 
 
 class Colors:
@@ -69,6 +89,17 @@ class Parser(argparse.ArgumentParser):
         self.init = self._args.init
         self.force = self._args.force
         self.dry = self._args.dry
+        self.relink = self._args.relink
+        self.jobs = self._args.jobs
+        self.status = self._args.status
+        self.verify = self._args.verify
+        self.rollback = self._args.rollback
+        self.resume = self._args.resume
+        self.store = self._args.store
+        self.gc = self._args.gc
+        self.keep = self._args.keep
+        self.max_age = self._args.max_age
+        self.restore = self._args.restore
 
     def _add_arguments(self):
         self.add_argument(
@@ -92,117 +123,920 @@ class Parser(argparse.ArgumentParser):
             action="store_true",
             help="see what actions would take place",
         )
+        self.add_argument(
+            "-r",
+            "--relink",
+            action="store_true",
+            help="back up and relink dotfiles that are already linked",
+        )
+        self.add_argument(
+            "-j",
+            "--jobs",
+            action="store",
+            type=int,
+            default=1,
+            metavar="N",
+            help="link up to N independent groups of dotfiles at once",
+        )
+        self.add_argument(
+            "-s",
+            "--status",
+            action="store_true",
+            help="show what the last install linked and exit",
+        )
+        self.add_argument(
+            "-v",
+            "--verify",
+            action="store_true",
+            help="check every link on disk instead of trusting the state",
+        )
+        self.add_argument(
+            "--rollback",
+            action="store_true",
+            help="undo an install that did not finish",
+        )
+        self.add_argument(
+            "--resume",
+            action="store_true",
+            help="finish an install that did not finish",
+        )
+        self.add_argument(
+            "--store",
+            action="store_true",
+            help="move backups into the deduplicated backup store",
+        )
+        self.add_argument(
+            "--gc",
+            action="store_true",
+            help=(
+                "move old backups into the backup store and remove any "
+                "stored backups not kept by --keep or --max-age"
+            ),
+        )
+        self.add_argument(
+            "--keep",
+            action="store",
+            type=int,
+            metavar="N",
+            help="with --gc keep the last N backups of each dotfile",
+        )
+        self.add_argument(
+            "--max-age",
+            action="store",
+            type=float,
+            metavar="DAYS",
+            help="with --gc keep backups newer than DAYS",
+        )
+        self.add_argument(
+            "--restore",
+            action="store",
+            metavar="PATH",
+            help="restore the last stored backup of PATH beside it",
+        )
+
 
+def _notice(color, label, source, dest):
+    paint = Colors(color)
+    return f"{paint.get(label)} {source} {paint.get('->')} {dest}"
 
-def move(source, dest, dry):
+
+def move(source, dest):
     """Move file if it exists to make way for new symlink without
     destroying the old file. Append the date and time to the old backup
     to avoid name collisions.
 
     :param source:  The old, existing, file.
     :param dest:    The dotfiles symlink.
-    :param dry:     Print what would but do not do anything if True.
-                    Announce that this is happening.
+    :return:        Notice of what happened.
     """
-    yellow = Colors("yellow")
-    notify = f"{yellow.get('[BACKUP ]')} {source} {yellow.get('->')} {dest}"
-
-    if not dry:
-        os.rename(source, dest)
-        print(notify)
-
-    else:
-        print(f"[{Colors('magenta').get('DRY-RUN')}]{notify}")
+    os.rename(source, dest)
+    return _notice("yellow", "[BACKUP ]", source, dest)
 
 
-def symlink(source, dest, dry):
+def symlink(source, dest):
     """Symlink dotfile to its usable location and display what is
     happening.
 
     :param source:  The file in this repository.
     :param dest:    The symlink's path.
-    :param dry:     Print what would but do not do anything if True.
-                    Announce that this is happening.
+    :return:        Notice of what happened or None if the link's
+                    directory does not exist.
     """
-    cyan = Colors("cyan")
-    notify = f"{cyan.get('[SYMLINK]')} {source} {cyan.get('->')} {dest}"
+    try:
+        os.symlink(source, dest)
+        return _notice("cyan", "[SYMLINK]", source, dest)
 
-    if not dry:
-        try:
-            os.symlink(source, dest)
-            print(notify)
+    except FileNotFoundError:
+        return None
 
-        except FileNotFoundError:
-            pass
 
-    else:
-        print(f"[{Colors('magenta').get('DRY-RUN')}]{notify}")
+def perform(op, first, second):
+    """Carry out a single step of a link.
+
+    :param op:      "backup", "remove" or "symlink".
+    :param first:   The path to back up or remove, or the link source.
+    :param second:  The backup path, the removed link's target, or the
+                    link destination.
+    :return:        Tuple of whether anything changed and the notice of
+                    what happened, if any.
+    """
+    if op == "backup":
+        return True, move(first, second)
 
+    if op == "remove":
+        os.remove(first)
+        return True, None
 
-def linkdest(source, dest, dry):
-    """Determine that a path exists to back it up first. Attempt to
-    symlink the dotfile. If a FileExistsError occurs move was unable to
-    move the file and it is most likely a dead-link - the file is safe
-    to remove. Again attempt to symlink - which this time should work.
+    notice = symlink(first, second)
+    return notice is not None, notice
 
-    :param source:  root-file, child-file and key of main loop.
-    :param dest:    root-file and basename of dotfile to link.
-    :param dry:     Pass this argument on to the ``move`` process and
-                    the ``symlink`` process.
+
+def pending(op, first, second):
+    """Check a step against the filesystem to see whether it still
+    needs to be carried out.
+
+    :param op:      "backup", "remove" or "symlink".
+    :param first:   As passed to ``perform``.
+    :param second:  As passed to ``perform``.
+    :return:        Boolean: True if the step has not happened yet.
     """
-    # this won't work for broken symlinks
-    if os.path.exists(dest):
-        move(dest, f"{dest}.{SUFFIX}", dry)
+    if op in ("backup", "remove"):
+        return os.path.lexists(first)
 
-    # in the case of broken symlink - safe as file is already backed up
-    try:
-        symlink(source, dest, dry)
-    except FileExistsError:
-        os.remove(dest)
-        symlink(source, dest, dry)
+    return not (os.path.islink(second) and os.readlink(second) == first)
 
 
-def comment_yaml():
+def revert(op, first, second):
+    """Undo a single step of a link if it has been carried out.
 
-    with open(CONFIG) as fin:
-        conf = fin.read()
+    :param op:      "backup", "remove" or "symlink".
+    :param first:   As passed to ``perform``.
+    :param second:  As passed to ``perform``.
+    :return:        Notice of what was undone or None.
+    """
+    if op == "backup":
+        if os.path.lexists(second) and not os.path.lexists(first):
+            os.rename(second, first)
+            return _notice("yellow", "[RESTORE]", second, first)
 
-    with open(CONFIG, "w") as fout:
-        fout.write(comments.COMMENTS + conf)
+    elif op == "remove":
+        if not os.path.lexists(first):
+            os.symlink(second, first)
+            return _notice("yellow", "[RESTORE]", second, first)
 
+    elif not pending(op, first, second):
+        os.remove(second)
+        return _notice("yellow", "[UNLINK ]", first, second)
+
+    return None
+
+
+class DirCache:
+    """Cache the contents of every destination directory so each one
+    is listed with a single ``os.scandir`` call, however many dotfiles
+    are linked into it. ``os.DirEntry`` objects cache their own
+    ``lstat`` results so they are kept rather than re-queried.
+    """
 
-def link_dirs(dirs, source, dirpath, dry):
+    def __init__(self):
+        self._dirs = {}
+
+    @staticmethod
+    def _scan(dirname):
+        try:
+            with os.scandir(dirname) as entries:
+                return {entry.name: entry for entry in entries}
+
+        except (FileNotFoundError, NotADirectoryError):
+            return {}
+
+    def lookup(self, path):
+        """Get the cached entry for a path.
+
+        :param path:    Absolute path to look up.
+        :return:        ``os.DirEntry`` or None if nothing is there.
+        """
+        dirname, basename = os.path.split(path)
+        if dirname not in self._dirs:
+            self._dirs[dirname] = self._scan(dirname)
+
+        return self._dirs[dirname].get(basename)
+
+    def names(self, dirname):
+        """Get the names of everything in a directory that has already
+        been looked up.
+
+        :param dirname: Absolute path to the directory.
+        :return:        List of names.
+        """
+        return list(self._dirs.get(dirname, {}))
+
+
+def _dir_links(dirs, source, dirpath):
     for dotdir, dotfiles in dirs.items():
-        dotfile_source = os.path.join(source, dotdir)
         dotdir_dest = os.path.expanduser(dirpath) + dotdir
-        linkdest(dotfile_source, dotdir_dest, dry)
-
+        group = [(os.path.join(source, dotdir), dotdir_dest)]
         for dotfile in dotfiles:
-            dotfile_source = os.path.join(HOME, dotdir_dest, dotfile)
-            dotfile_dest = os.path.expanduser(dirpath) + dotfile
-            linkdest(dotfile_source, dotfile_dest, dry)
+            group.append(
+                (
+                    os.path.join(HOME, dotdir_dest, dotfile),
+                    os.path.expanduser(dirpath) + dotfile,
+                )
+            )
+
+        yield group
 
 
-def link_files(files, source, dirpath, dry):
+def _file_links(files, source, dirpath):
+    group = []
     for file in files:
-        dotfile_source = os.path.join(source, file)
         filename = os.path.basename(file)
-        dotfile_dest = os.path.expanduser(dirpath) + filename
-        linkdest(dotfile_source, dotfile_dest, dry)
+        group.append(
+            (
+                os.path.join(source, file),
+                os.path.expanduser(dirpath) + filename,
+            )
+        )
+
+    yield group
 
 
-def link_all(conf, dry):
-    source = os.path.join(HOME, ".dotfiles", "src")
+def link_groups(conf):
+    """Get every link in the conf: firstly the dirs and then the files.
+
+    Links are grouped as a dotdir together with the dotfiles linked
+    through it, or all the files for one destination.
+
+    :param conf:    ``dict`` loaded from the yaml conf.
+    :return:        Generator of lists of source and destination pairs.
+    """
+    source = source_dir()
 
     for dot_type in conf:
 
         for dirpath, obj in conf[dot_type].items():
 
             if dot_type == "dirs":
-                link_dirs(obj, source, dirpath, dry)
+                yield from _dir_links(obj, source, dirpath)
 
             elif dot_type == "files":
-                link_files(obj, source, dirpath, dry)
+                yield from _file_links(obj, source, dirpath)
+
+
+class Link:
+    """A single planned symlink and what needs to happen to its
+    destination beforehand.
+
+    :param source:  The file in this repository.
+    :param dest:    The symlink's path.
+    """
+
+    def __init__(self, source, dest):
+        self.source = source
+        self.dest = dest
+        self.backup = None
+        self.remove = False
+        self.done = False
+        self._steps = None
+
+    def steps(self):
+        """Get the steps that make up this link, in order.
+
+        :return: List of arguments for ``perform``.
+        """
+        if self._steps is None:
+            self._steps = []
+            if self.backup is not None:
+                self._steps.append(("backup", self.dest, self.backup))
+
+            elif self.remove:
+                self._steps.append(
+                    ("remove", self.dest, os.readlink(self.dest))
+                )
+
+            self._steps.append(("symlink", self.source, self.dest))
+
+        return self._steps
+
+    def apply(self, journal=None):
+        """Back up or remove whatever is in the way and then link.
+
+        :param journal: ``Journal`` to mark each step in as it is done.
+        :return:        List of notices of what happened.
+        """
+        notices = []
+        for step in self.steps():
+            self.done, notice = perform(*step)
+            if self.done and journal is not None:
+                journal.mark(step)
+
+            if notice is not None:
+                notices.append(notice)
+
+        return notices
+
+    def render(self):
+        """Announce what ``apply`` would do without doing it.
+
+        :return: List of notices of what would happen.
+        """
+        dry = f"[{Colors('magenta').get('DRY-RUN')}]"
+        notices = []
+        if self.backup is not None:
+            notices.append(
+                dry + _notice("yellow", "[BACKUP ]", self.dest, self.backup)
+            )
+
+        notices.append(
+            dry + _notice("cyan", "[SYMLINK]", self.source, self.dest)
+        )
+        return notices
+
+
+def _apply_group(links, journal):
+    notices = []
+    for link in links:
+        notices.extend(link.apply(journal))
+
+    return notices
+
+
+class Plan:
+    """Work out every link from the conf before touching anything and
+    then apply them all in one pass.
+
+    Links are planned in groups: a dotdir together with the dotfiles
+    linked through it, or all the files for one destination. Groups do
+    not depend on each other so they can be applied concurrently.
+
+    :param conf:    ``dict`` loaded from the yaml conf.
+    :param relink:  Relink dotfiles even if they are already linked to
+                    the right source.
+    :param known:   ``dict`` of links, by destination, that the last
+                    install made. These are only read back with
+                    ``os.readlink`` rather than listing their
+                    directories.
+    """
+
+    def __init__(self, conf, relink=False, known=None):
+        self.conf = conf
+        self.relink = relink
+        self.known = known or {}
+        self.groups = []
+        self.current = {}
+        self._cache = DirCache()
+
+    def _add(self, source, dest):
+        if (
+            not self.relink
+            and self.known.get(dest) == source
+            and _points_to(dest, source)
+        ):
+            self.current[dest] = source
+            return
+
+        link = Link(source, dest)
+        entry = self._cache.lookup(dest)
+        if entry is not None:
+
+            # nothing to do if the link already points to the source
+            if (
+                not self.relink
+                and entry.is_symlink()
+                and os.readlink(dest) == source
+            ):
+                self.current[dest] = source
+                return
+
+            # a broken symlink is safe to remove - otherwise back it up
+            if entry.is_symlink() and not _resolves(entry):
+                link.remove = True
+            else:
+                link.backup = f"{dest}.{SUFFIX}"
+
+        self.groups[-1].append(link)
+
+    def build(self):
+        """Collect the links for the dirs and then the files."""
+        for group in link_groups(self.conf):
+            self.groups.append([])
+            for source, dest in group:
+                self._add(source, dest)
+
+    def report(self):
+        """Announce how many links were left as they were."""
+        if self.current:
+            print(Colors("green").get(f"{len(self.current)} up to date"))
+
+    @property
+    def links(self):
+        """All planned links in the order they were planned."""
+        return [link for group in self.groups for link in group]
+
+    def linked(self):
+        """Get every link that is in place after ``apply``.
+
+        :return: ``dict`` of sources by destination.
+        """
+        linked = dict(self.current)
+        linked.update({i.dest: i.source for i in self.links if i.done})
+        return linked
+
+    def apply(self, jobs=1, journal=None):
+        """Carry out the plan. Notices are printed in the order they
+        were planned whether or not the groups are linked concurrently.
+
+        If a ``Journal`` is given every step is written to it before
+        anything is changed and it is only removed once every step has
+        been carried out.
+
+        :param jobs:    Number of groups to link at once.
+        :param journal: ``Journal`` to record the steps in.
+        """
+        links = self.links
+        if journal is not None and links:
+            journal.begin([step for link in links for step in link.steps()])
+
+        finished = False
+        try:
+            if jobs > 1:
+                with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+                    for notices in executor.map(
+                        _apply_group,
+                        self.groups,
+                        [journal] * len(self.groups),
+                    ):
+                        for notice in notices:
+                            print(notice)
+            else:
+                for link in links:
+                    for notice in link.apply(journal):
+                        print(notice)
+
+            finished = True
+
+        finally:
+            if journal is not None and links:
+                journal.close(finished)
+
+        self.report()
+
+    def render(self):
+        """Show the plan without carrying it out."""
+        for link in self.links:
+            for notice in link.render():
+                print(notice)
+
+        self.report()
+
+
+class State:
+    """Record of what the last install linked, kept alongside the conf,
+    so that a re-run only has to look at the entries that changed.
+
+    :param path: Path to the state file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hash = None
+        self.mtime = None
+        self.links = {}
+
+    def read(self):
+        """Load the state left by the last install if there is one."""
+        try:
+            with open(self.path) as fin:
+                obj = json.load(fin)
+
+        except (FileNotFoundError, ValueError):
+            return
+
+        self.hash = obj.get("hash")
+        self.mtime = obj.get("mtime")
+        self.links = obj.get("links", {})
+
+    def write(self):
+        """Save the state for the next install."""
+        with open(self.path, "w") as fout:
+            json.dump(
+                dict(hash=self.hash, mtime=self.mtime, links=self.links),
+                fout,
+                indent=4,
+                sort_keys=True,
+            )
+
+    def matches(self, conf_hash, mtime):
+        """Check whether the state was recorded from the same conf and
+        source tree.
+
+        :param conf_hash:   Hash of the conf as returned by ``digest``.
+        :param mtime:       Key of the source tree from ``source_key``.
+        :return:            Boolean: True if the state is current.
+        """
+        return self.hash == conf_hash and self.mtime == mtime
+
+    def report(self, conf_hash, mtime):
+        """Show what the last install linked without looking at any of
+        the links.
+
+        :param conf_hash:   Hash of the conf as returned by ``digest``.
+        :param mtime:       Key of the source tree from ``source_key``.
+        """
+        if self.hash is None:
+            print("nothing has been installed yet")
+            return
+
+        yellow = Colors("yellow")
+        for dest, source in sorted(self.links.items()):
+            print(_notice("green", "[LINKED ]", source, dest))
+
+        print(f"{len(self.links)} managed links")
+        if self.hash != conf_hash:
+            print(yellow.get("conf has changed since last install"))
+
+        if self.mtime != mtime:
+            print(yellow.get("source has changed since last install"))
+
+
+class Journal:
+    """Write-ahead journal of the steps of an install so that one that
+    fails or is interrupted can be rolled back or resumed from the
+    journal alone.
+
+    Every step is written and synced before the first one is carried
+    out and each one is marked as it is done. Rolling back and resuming
+    only look at the paths in the journal.
+
+    :param path: Path to the journal file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.steps = []
+        self.done = set()
+        self._index = {}
+        self._file = None
+        self._lock = threading.Lock()
+
+    def exists(self):
+        """Check for an install that did not finish.
+
+        :return: Boolean: True if there is a journal left behind.
+        """
+        return os.path.isfile(self.path)
+
+    def read(self):
+        """Load the steps, and which of them were done, from the journal
+        left behind.
+        """
+        with open(self.path) as fin:
+            for line in fin:
+                try:
+                    obj = json.loads(line)
+
+                # the last line may have been cut short
+                except ValueError:
+                    break
+
+                if "step" in obj:
+                    self.steps.append(tuple(obj["step"]))
+
+                elif "done" in obj:
+                    self.done.add(obj["done"])
+
+        self._index = {step: idx for idx, step in enumerate(self.steps)}
+
+    def begin(self, steps):
+        """Write every step to the journal before any is carried out.
+
+        :param steps: List of arguments for ``perform``.
+        """
+        self.steps = list(steps)
+        self._index = {step: idx for idx, step in enumerate(self.steps)}
+        self._file = open(self.path, "w")
+        for step in self.steps:
+            self._file.write(json.dumps(dict(step=step)) + "\n")
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def mark(self, step):
+        """Mark a step as done.
+
+        :param step: Arguments that were passed to ``perform``.
+        """
+        with self._lock:
+            self._file.write(json.dumps(dict(done=self._index[step])) + "\n")
+            self._file.flush()
+
+    def close(self, finished):
+        """Close the journal and remove it if the install finished.
+
+        :param finished: Boolean: True if every step was carried out.
+        """
+        self._file.close()
+        if finished:
+            os.remove(self.path)
+
+    def resume(self):
+        """Carry out every step that was not done."""
+        self.read()
+        self._file = open(self.path, "a")
+        finished = False
+        try:
+            for idx, step in enumerate(self.steps):
+                if idx not in self.done and pending(*step):
+                    changed, notice = perform(*step)
+                    if changed:
+                        self.mark(step)
+
+                    if notice is not None:
+                        print(notice)
+
+            finished = True
+
+        finally:
+            self.close(finished)
+
+    def rollback(self):
+        """Undo every step that was done, last first."""
+        self.read()
+        for step in reversed(self.steps):
+            notice = revert(*step)
+            if notice is not None:
+                print(notice)
+
+        os.remove(self.path)
+
+
+class Backups:
+    """Content-addressed store, kept under the conf dir, for backed up
+    dotfiles. Files are stored once by their hash however many times
+    they are backed up. Directories are stored as trees of hashed files
+    and symlinks only as their target.
+
+    :param path: Path to the store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = []
+        self._objects = os.path.join(path, "objects")
+        self._index = os.path.join(path, "index.json")
+
+    def read(self):
+        """Load the index of stored backups."""
+        try:
+            with open(self._index) as fin:
+                self.records = json.load(fin)
+
+        except (FileNotFoundError, ValueError):
+            self.records = []
+
+    def write(self):
+        """Save the index of stored backups."""
+        pathlib.Path(self.path).mkdir(parents=True, exist_ok=True)
+        with open(self._index, "w") as fout:
+            json.dump(self.records, fout, indent=4)
+
+    def _object(self, path):
+        hashcap = HashCap(path)
+        hashcap.hash_file()
+        hexdigest = hashcap.snapshot[-1]
+        obj = os.path.join(self._objects, hexdigest)
+        if os.path.exists(obj):
+            os.remove(path)
+        else:
+            shutil.move(path, obj)
+
+        return hexdigest
+
+    def _tree(self, path):
+        tree = {}
+        for root, dirs, files in os.walk(path):
+            for name in dirs + files:
+                fullpath = os.path.join(root, name)
+                relpath = os.path.relpath(fullpath, path)
+                if os.path.islink(fullpath):
+                    tree[relpath] = ["link", os.readlink(fullpath)]
+
+                elif name in dirs:
+                    tree[relpath] = ["dir"]
+
+                else:
+                    mode = os.stat(fullpath).st_mode & 0o7777
+                    tree[relpath] = ["file", self._object(fullpath), mode]
+
+        shutil.rmtree(path)
+        return tree
+
+    def add(self, path, dest, suffix):
+        """Move a backup into the store.
+
+        :param path:    Path to the backup.
+        :param dest:    The dotfile the backup was made of.
+        :param suffix:  The time suffix the backup was made with.
+        :return:        Notice of what was stored.
+        """
+        pathlib.Path(self._objects).mkdir(parents=True, exist_ok=True)
+        record = dict(path=dest, suffix=suffix, time=_suffix_time(suffix))
+        if os.path.islink(path):
+            record["link"] = os.readlink(path)
+            os.remove(path)
+
+        elif os.path.isdir(path):
+            record["tree"] = self._tree(path)
+
+        else:
+            record["mode"] = os.stat(path).st_mode & 0o7777
+            record["file"] = self._object(path)
+
+        self.records.append(record)
+        return _notice("yellow", "[STORE  ]", path, self.path)
+
+    def prune(self, keep=None, max_age=None):
+        """Remove stored backups that are not the last ``keep`` backups
+        of their dotfile or newer than ``max_age`` days. Then remove
+        every stored file that is no longer referenced.
+
+        :param keep:    Number of backups to keep for each dotfile.
+        :param max_age: Age, in days, under which backups are kept.
+        :return:        Number of backups removed.
+        """
+        count = len(self.records)
+        if keep is not None or max_age is not None:
+            cutoff = time.time() - (max_age or 0) * 86400
+            seen = {}
+            records = []
+            for record in sorted(self.records, key=lambda r: -r["time"]):
+                seen[record["path"]] = seen.get(record["path"], 0) + 1
+                if (keep is not None and seen[record["path"]] <= keep) or (
+                    max_age is not None and record["time"] >= cutoff
+                ):
+                    records.append(record)
+
+            self.records = records
+
+        referenced = set()
+        for record in self.records:
+            if "file" in record:
+                referenced.add(record["file"])
+
+            for obj in record.get("tree", {}).values():
+                if obj[0] == "file":
+                    referenced.add(obj[1])
+
+        if os.path.isdir(self._objects):
+            with os.scandir(self._objects) as entries:
+                for entry in entries:
+                    if entry.name not in referenced:
+                        os.remove(entry.path)
+
+        return count - len(self.records)
+
+    def restore(self, dest):
+        """Restore the last stored backup of a dotfile beside it, with
+        the time suffix of this run.
+
+        :param dest:    The dotfile to restore the backup of.
+        :return:        Path to the restored backup or None if there is
+                        no backup of ``dest``.
+        """
+        records = [r for r in self.records if r["path"] == dest]
+        if not records:
+            return None
+
+        record = max(records, key=lambda r: r["time"])
+        path = f"{dest}.{SUFFIX}"
+        if "link" in record:
+            os.symlink(record["link"], path)
+
+        elif "tree" in record:
+            os.mkdir(path)
+            for relpath, obj in sorted(record["tree"].items()):
+                self._restore(obj, os.path.join(path, relpath))
+
+        else:
+            self._restore(["file", record["file"], record["mode"]], path)
+
+        return path
+
+    def _restore(self, obj, path):
+        if obj[0] == "link":
+            os.symlink(obj[1], path)
+
+        elif obj[0] == "dir":
+            os.mkdir(path)
+
+        else:
+            shutil.copyfile(os.path.join(self._objects, obj[1]), path)
+            os.chmod(path, obj[2])
+
+
+def _suffix_time(suffix):
+    return datetime.datetime.strptime(suffix, "%d%m%YT%H%M%S").timestamp()
+
+
+def collect(conf, backups):
+    """Move every backup left beside a dotfile in the conf into the
+    backup store.
+
+    :param conf:    ``dict`` loaded from the yaml conf.
+    :param backups: ``Backups`` store to move them into.
+    """
+    cache = DirCache()
+    for group in link_groups(conf):
+        for _, dest in group:
+            dirname, basename = os.path.split(dest)
+            cache.lookup(dest)
+            pattern = re.compile(re.escape(basename) + r"\.(\d{8}T\d{6})$")
+            for name in sorted(cache.names(dirname)):
+                match = pattern.match(name)
+                if match is not None:
+                    print(
+                        backups.add(
+                            os.path.join(dirname, name), dest, match.group(1)
+                        )
+                    )
+
+
+def source_dir():
+    """Get the dotfiles source directory.
+
+    :return: Absolute path to the directory the dotfiles link to.
+    """
+    return os.path.join(HOME, ".dotfiles", "src")
+
+
+def digest(conf):
+    """Hash the conf so that changes can be detected regardless of
+    formatting or comments.
+
+    :param conf:    ``dict`` loaded from the yaml conf.
+    :return:        Hex digest of the conf.
+    """
+    dump = json.dumps(conf, sort_keys=True).encode()
+    return hashlib.sha256(dump).hexdigest()
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+
+    except FileNotFoundError:
+        return None
+
+
+def source_key(conf):
+    """Key the source tree on the mtimes of every directory that holds
+    a source in the conf, so that adding or removing a file anywhere in
+    the tree is noticed and not only at the top level.
+
+    :param conf:    ``dict`` loaded from the yaml conf.
+    :return:        Hex digest of the directories and their mtimes.
+    """
+    dirs = {os.path.dirname(s) for g in link_groups(conf) for s, _ in g}
+    dirs.add(source_dir())
+    dump = json.dumps([[d, _mtime(d)] for d in sorted(dirs)]).encode()
+    return hashlib.sha256(dump).hexdigest()
+
+
+def _points_to(dest, source):
+    try:
+        return os.readlink(dest) == source
+
+    except OSError:
+        return False
+
+
+def _resolves(entry):
+    try:
+        entry.stat()
+        return True
+
+    except OSError:
+        return False
+
+
+def comment_yaml():
+
+    with open(CONFIG) as fin:
+        conf = fin.read()
+
+    with open(CONFIG, "w") as fout:
+        fout.write(comments.COMMENTS + conf)
+
+
+def link_all(conf, dry, relink=False, jobs=1, known=None, journal=None):
+    plan = Plan(conf, relink, known)
+    plan.build()
+    if dry:
+        plan.render()
+    else:
+        plan.apply(jobs, journal)
+
+    return plan
 
 
 def main():
@@ -233,9 +1067,82 @@ def main():
             print("created default conf:")
             print(CONFIG)
 
-    if not parser.init:
-        link_all(conf.dict, parser.dry)
+    state = State(os.path.join(CONFIGDIR, STATE))
+    state.read()
+    conf_hash = digest(conf.dict)
+    mtime = source_key(conf.dict)
+    journal = Journal(os.path.join(CONFIGDIR, JOURNAL))
+
+    if parser.status:
+        state.report(conf_hash, mtime)
 
-        if parser.dry:
+    elif parser.gc or parser.restore:
+        backups = Backups(os.path.join(CONFIGDIR, BACKUPS))
+        backups.read()
+        if parser.restore:
+            restored = backups.restore(os.path.abspath(parser.restore))
+            print(restored or f"no backup of {parser.restore} stored")
+
+        else:
+            collect(conf.dict, backups)
+            removed = backups.prune(parser.keep, parser.max_age)
+            print(f"{len(backups.records)} backups stored, {removed} removed")
+
+        backups.write()
+
+    elif parser.rollback or parser.resume:
+        if not journal.exists():
+            print("no unfinished install found")
+
+        elif parser.rollback:
+            journal.rollback()
+
+        else:
+            journal.resume()
+
+    elif not parser.init:
+        if journal.exists() and not parser.dry:
+            raise SystemExit(
+                "an install did not finish: run with --rollback or --resume"
+            )
+
+        known = None
+        if not parser.verify and state.matches(conf_hash, mtime):
+            known = state.links
+
+        try:
+            plan = link_all(
+                conf.dict,
+                parser.dry,
+                parser.relink,
+                parser.jobs,
+                known,
+                journal,
+            )
+
+        except OSError as err:
+            raise SystemExit(
+                f"install failed: {err}\n"
+                "run with --rollback or --resume to recover"
+            ) from err
+
+        if parser.store and not parser.dry:
+            backups = Backups(os.path.join(CONFIGDIR, BACKUPS))
+            backups.read()
+            for link in plan.links:
+                if link.backup is not None and os.path.lexists(link.backup):
+                    print(backups.add(link.backup, link.dest, SUFFIX))
+
+            backups.write()
+
+        if not parser.dry:
+            # dotfiles linked through a dotdir are only reachable once
+            # the dotdir has been linked so key the tree as it is now
+            state.hash = conf_hash
+            state.mtime = source_key(conf.dict)
+            state.links = plan.linked()
+            state.write()
+
+        else:
             notice = Colors("magenta").get("***")
             print(f"\n{notice} No files have been changed {notice}")
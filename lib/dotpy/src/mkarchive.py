@@ -2,10 +2,15 @@
 mkarchive
 """
 import argparse
+import datetime
+import hashlib
+import json
 import os
 import pathlib
+import shutil
+import zlib
 
-from . import HOME, DATE, TIME, Tar
+from . import HOME, DATE, SUFFIX, TIME, AtomicWrite, HashCap, Tar
 
 
 class DirInfo:
@@ -31,6 +36,442 @@ class DirInfo:
         return self.old, self.new
 
 
+def _source_key(path):
+    # basename for people, hash of the full path for uniqueness
+    path = os.path.abspath(path)
+    key = hashlib.sha256(path.encode()).hexdigest()[:12]
+    return f"{os.path.basename(path)}.{key}"
+
+
+def _snapshot_key(name):
+    # time the snapshot was taken, then its number within that second
+    stem, _, count = name[:-5].partition("-")
+    return (
+        datetime.datetime.strptime(stem, "%d%m%YT%H%M%S"),
+        int(count or 0),
+    )
+
+
+def scan(path, previous=None):
+    """Record every entry under a directory.
+
+    Files are recorded as ``[size, mtime_ns, digest]``, symlinks as
+    ``[0, 0, "->target"]`` and directories as None. A file whose size
+    and mtime match ``previous`` keeps its digest without being read.
+
+    :param path:        Directory to scan.
+    :param previous:    Entries of the last scan, if any.
+    :return:            Dict of entries keyed by path relative to
+                        ``path``.
+    """
+    previous = previous or {}
+    entries = {}
+    stack = [""]
+    while stack:
+        rel = stack.pop()
+        with os.scandir(os.path.join(path, rel)) as items:
+            for item in items:
+                name = os.path.join(rel, item.name)
+                if item.is_symlink():
+                    entries[name] = [0, 0, "->" + os.readlink(item.path)]
+
+                elif item.is_dir():
+                    entries[name] = None
+                    stack.append(name)
+
+                else:
+                    stat = item.stat()
+                    entry = [stat.st_size, stat.st_mtime_ns]
+                    old = previous.get(name)
+                    if old is not None and old[:2] == entry:
+                        entries[name] = old
+
+                    else:
+                        digest = HashCap(item.path).digest()
+                        entries[name] = entry + [digest]
+
+    return dict(sorted(entries.items()))
+
+
+class Manifest:
+    """Entries of the last archive of a source and the chain of
+    archives, a full one followed by increments, which restore it.
+
+    :param dest:    Destination dir for archives.
+    :param path:    Path to the source being archived.
+    """
+
+    def __init__(self, dest, path):
+        self.path = os.path.join(
+            dest, ".manifests", _source_key(path) + ".json"
+        )
+        self.root = os.path.abspath(path).lstrip(os.sep)
+        self.files = {}
+        self.chain = []
+
+    def read(self):
+        """Read the manifest if one has been written.
+
+        :return: True if there was a manifest to read, else False.
+        """
+        try:
+            with open(self.path) as fin:
+                data = json.load(fin)
+
+        except FileNotFoundError:
+            return False
+
+        self.root = data["root"]
+        self.files = data["files"]
+        self.chain = data["chain"]
+        return True
+
+    def write(self):
+        """Write the manifest atomically so a failed run leaves the last
+        one in place.
+        """
+        with AtomicWrite(self.path) as fout:
+            json.dump(
+                {"root": self.root, "files": self.files, "chain": self.chain},
+                fout,
+            )
+
+    def update(self, entries):
+        """Work out what changed since the last archive.
+
+        A path which changed between a directory and anything else
+        is both deleted and added.
+
+        :param entries: Entries returned by ``scan``.
+        :return:        Tuple of paths to add and paths deleted.
+        """
+        deleted = [
+            k
+            for k, v in self.files.items()
+            if k not in entries or (v is None) != (entries[k] is None)
+        ]
+        added = [
+            k
+            for k, v in entries.items()
+            if k not in self.files or v is not None and self.files[k] != v
+        ]
+        self.files = entries
+        return added, deleted
+
+    def restore(self, target):
+        """Replay the chain into a directory, extracting each archive in
+        turn and removing what was deleted before it was made.
+
+        :param target: Directory to restore into.
+        """
+        for link in self.chain:
+            for rel in reversed(link["deleted"]):
+                path = os.path.join(target, self.root, rel)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+
+                elif os.path.lexists(path):
+                    os.remove(path)
+
+            Tar(None, link["archive"]).extract(dest=target)
+            print(f". {link['archive'].replace(HOME, '~')}")
+
+
+class ChunkStore:
+    """Deduplicated store of snapshots of directories.
+
+    Files are split into fixed size chunks which are stored once, keyed
+    by their blake2b digest, compressed and appended to pack files. A
+    snapshot only lists the chunks of each file, so storage grows with
+    the data that changed rather than with the number of snapshots.
+
+    :param path: Directory of the store.
+    """
+
+    CHUNK = 1 << 20
+    PACK = 64 << 20
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = os.path.join(path, "index.json")
+        self.index = {}
+        self.added = 0
+        self._pack = None
+        self._number = 0
+        pathlib.Path(path, "packs").mkdir(parents=True, exist_ok=True)
+        try:
+            with open(self.index_path) as fin:
+                self.index = json.load(fin)
+
+        except FileNotFoundError:
+            pass
+
+        packs = os.listdir(os.path.join(path, "packs"))
+        if packs:
+            self._number = max(int(p.split(".")[0]) for p in packs)
+
+    def _pack_path(self, number):
+        return os.path.join(self.path, "packs", f"{number:06d}.pack")
+
+    def put(self, data):
+        """Store a chunk unless it is already stored.
+
+        :param data:    Bytes of the chunk.
+        :return:        Digest of the chunk.
+        """
+        digest = hashlib.blake2b(data).hexdigest()
+        if digest in self.index:
+            return digest
+
+        if self._pack is None or self._pack.tell() >= self.PACK:
+            if self._pack is not None:
+                self._pack.close()
+                self._number += 1
+
+            self._pack = open(self._pack_path(self._number), "ab")
+
+        compressed = zlib.compress(data)
+        self.index[digest] = [
+            self._number,
+            self._pack.tell(),
+            len(compressed),
+        ]
+        self._pack.write(compressed)
+        self.added += len(compressed)
+        return digest
+
+    def get(self, digest):
+        """Read a chunk back out of its pack, checking it against its
+        digest.
+
+        :param digest:  Digest of the chunk.
+        :raises ValueError: If the chunk read is not the one stored.
+        :return:        Bytes of the chunk.
+        """
+        number, offset, length = self.index[digest]
+        with open(self._pack_path(number), "rb") as fin:
+            fin.seek(offset)
+            data = zlib.decompress(fin.read(length))
+
+        if hashlib.blake2b(data).hexdigest() != digest:
+            raise ValueError(f"chunk {digest} is corrupt")
+
+        return data
+
+    def close(self):
+        """Flush the open pack and write the index atomically, after
+        the chunks it points to.
+        """
+        if self._pack is not None:
+            self._pack.close()
+            self._pack = None
+
+        with AtomicWrite(self.index_path) as fout:
+            json.dump(self.index, fout)
+
+    def snapshots(self, source):
+        """List the snapshots of a source, oldest first.
+
+        :param source:  Path to the source.
+        :return:        List of paths to the snapshots.
+        """
+        path = os.path.join(self.path, "snapshots", _source_key(source))
+        if not os.path.isdir(path):
+            return []
+
+        names = sorted(
+            (n for n in os.listdir(path) if n.endswith(".json")),
+            key=_snapshot_key,
+        )
+        return [os.path.join(path, n) for n in names]
+
+    def _chunks(self, path):
+        chunks = []
+        with open(path, "rb") as fin:
+            for data in iter(lambda: fin.read(self.CHUNK), b""):
+                chunks.append(self.put(data))
+
+        return chunks
+
+    def snapshot(self, source, name):
+        """Store a snapshot of a directory.
+
+        A file whose size and mtime match the last snapshot reuses its
+        chunks without being read.
+
+        :param source:  Directory to snapshot.
+        :param name:    Name of the snapshot, numbered if one of that
+                        name is already stored.
+        :return:        Path to the snapshot.
+        """
+        previous = {}
+        snapshots = self.snapshots(source)
+        if snapshots:
+            with open(snapshots[-1]) as fin:
+                previous = json.load(fin)["entries"]
+
+        entries = {}
+        stack = [""]
+        while stack:
+            rel = stack.pop()
+            with os.scandir(os.path.join(source, rel)) as items:
+                for item in items:
+                    member = os.path.join(rel, item.name)
+                    stat = item.stat(follow_symlinks=False)
+                    if item.is_symlink():
+                        entries[member] = {"link": os.readlink(item.path)}
+
+                    elif item.is_dir(follow_symlinks=False):
+                        entries[member] = {"mode": stat.st_mode}
+                        stack.append(member)
+
+                    else:
+                        entry = {
+                            "mode": stat.st_mode,
+                            "size": stat.st_size,
+                            "mtime": stat.st_mtime_ns,
+                        }
+                        old = previous.get(member, {})
+                        if all(old.get(k) == v for k, v in entry.items()):
+                            entry["chunks"] = old["chunks"]
+
+                        else:
+                            entry["chunks"] = self._chunks(item.path)
+
+                        entries[member] = entry
+
+        self.close()
+        path = os.path.join(self.path, "snapshots", _source_key(source), name)
+
+        # snapshots taken within the same second are numbered rather
+        # than overwriting each other
+        unique, count = path, 0
+        while os.path.exists(unique + ".json"):
+            count += 1
+            unique = f"{path}-{count}"
+
+        path = unique + ".json"
+        with AtomicWrite(path) as fout:
+            json.dump(
+                {
+                    "root": os.path.abspath(source).lstrip(os.sep),
+                    "entries": dict(sorted(entries.items())),
+                },
+                fout,
+            )
+
+        return path
+
+    def restore(self, snapshot, target):
+        """Restore a snapshot into a directory, laid out as extracting
+        an archive of the source would be.
+
+        :param snapshot:    Path to the snapshot.
+        :param target:      Directory to restore into.
+        """
+        with open(snapshot) as fin:
+            data = json.load(fin)
+
+        root = os.path.join(target, data["root"])
+        pathlib.Path(root).mkdir(parents=True, exist_ok=True)
+        entries = data["entries"]
+        for rel, entry in entries.items():
+            path = os.path.join(root, rel)
+            if "link" in entry:
+                if os.path.lexists(path):
+                    os.remove(path)
+
+                os.symlink(entry["link"], path)
+
+            elif "chunks" not in entry:
+                pathlib.Path(path).mkdir(exist_ok=True)
+
+            else:
+                with open(path, "wb") as fout:
+                    for digest in entry["chunks"]:
+                        fout.write(self.get(digest))
+
+                os.chmod(path, entry["mode"] & 0o7777)
+                os.utime(path, ns=(entry["mtime"], entry["mtime"]))
+
+        # after their contents, which could not be written otherwise
+        for rel, entry in reversed(entries.items()):
+            if "mode" in entry and "chunks" not in entry:
+                os.chmod(os.path.join(root, rel), entry["mode"] & 0o7777)
+
+
+def _store(args):
+    store = ChunkStore(os.path.join(args.dest, ".store"))
+    if args.restore is not None:
+        snapshots = store.snapshots(args.path)
+        if args.snapshot is not None:
+            snapshots = [
+                s
+                for s in snapshots
+                if os.path.basename(s) == args.snapshot + ".json"
+            ]
+
+        if not snapshots:
+            raise SystemExit(f"no stored snapshot of {args.path}")
+
+        print(f"Restoring {snapshots[-1].replace(HOME, '~')}")
+        store.restore(snapshots[-1], args.restore)
+
+    else:
+        print("Storing snapshot")
+        path = store.snapshot(args.path, SUFFIX)
+        print(
+            f". created {path.replace(HOME, '~')}: {store.added} bytes "
+            f"added, {len(store.index)} chunks stored"
+        )
+
+    print("Done")
+
+
+def _restore(args):
+    manifest = Manifest(args.dest, args.path)
+    if not manifest.read():
+        raise SystemExit(f"no incremental archives of {args.path}")
+
+    print(f"Restoring {len(manifest.chain)} archives to {args.restore}")
+    manifest.restore(args.restore)
+    print("Done")
+
+
+def _incremental(args, dst_path, infile_name):
+    manifest = Manifest(args.dest, args.path)
+    full = not manifest.read() or args.full
+    entries = scan(args.path, manifest.files)
+    if full:
+        manifest.files, manifest.chain = {}, []
+
+    added, deleted = manifest.update(entries)
+    if not full and not added and not deleted:
+        print(f"No changes to {args.path} since the last archive")
+        return None
+
+    suffix = "" if full else f".inc{len(manifest.chain)}"
+    archive_name = f"{TIME}.{infile_name}{suffix}{Tar.CODECS[args.codec]}"
+    tarobj = Tar(
+        os.path.abspath(args.path),
+        os.path.join(dst_path, archive_name),
+        args.codec,
+        args.level,
+        args.jobs,
+        added,
+    )
+    print(
+        f"Making {'full' if full else 'incremental'} archive: "
+        f"{len(added)} added, {len(deleted)} deleted"
+    )
+    tarobj.compress()
+    manifest.chain.append(
+        {"archive": os.path.abspath(tarobj.archive), "deleted": deleted}
+    )
+    manifest.write()
+    return archive_name
+
+
 def main():
     parser = argparse.ArgumentParser()
 
@@ -44,15 +485,78 @@ def main():
         default=os.path.join(HOME, "Documents", "Archive"),
         help="destination dir for archive",
     )
+    parser.add_argument(
+        "-c",
+        "--codec",
+        action="store",
+        choices=list(Tar.CODECS),
+        default="gz",
+        help="compression for the archive",
+    )
+    parser.add_argument(
+        "-l",
+        "--level",
+        action="store",
+        type=int,
+        help="compression level",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        default=1,
+        help="number of threads to compress with",
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="only archive what changed since the last incremental archive",
+    )
+    parser.add_argument(
+        "-f",
+        "--full",
+        action="store_true",
+        help="start a new chain of incremental archives with a full one",
+    )
+    parser.add_argument(
+        "-r",
+        "--restore",
+        metavar="DIR",
+        action="store",
+        help="replay the chain of incremental archives of PATH into DIR",
+    )
+    parser.add_argument(
+        "-s",
+        "--store",
+        action="store_true",
+        help="keep a snapshot in the deduplicated store under DEST",
+    )
+    parser.add_argument(
+        "--snapshot",
+        metavar="NAME",
+        action="store",
+        help="snapshot to restore from the store, the latest by default",
+    )
     args = parser.parse_args()
+    if args.store:
+        if not os.path.isdir(args.path) and args.restore is None:
+            parser.error("snapshots can only be made of a dir")
+
+        _store(args)
+        return
+
+    if args.restore is not None:
+        _restore(args)
+        return
+
+    if (args.incremental or args.full) and not os.path.isdir(args.path):
+        parser.error("incremental archives can only be made of a dir")
+
     dst_path = os.path.join(args.dest, DATE)
-    infile_dir = os.path.dirname(args.path)
-    infile_name = os.path.basename(args.path)
-    archive_name = f"{TIME}.{infile_name}.tar.gz"
-    archive_path = os.path.join(infile_dir, archive_name)
-    full_path = os.path.join(dst_path, archive_name)
+    infile_name = os.path.basename(args.path.rstrip(os.sep))
     dir_info = DirInfo(dst_path)
-    tarobj = Tar(args.path, archive_name)
 
     dir_info.collate_info()
 
@@ -63,12 +567,24 @@ def main():
 
     pathlib.Path(dst_path).mkdir(parents=True, exist_ok=True)
 
-    print("Making archive")
-    tarobj.compress()
-    print(f". created {archive_name}")
+    if args.incremental or args.full:
+        archive_name = _incremental(args, dst_path, infile_name)
+        if archive_name is None:
+            return
+
+    else:
+        archive_name = f"{TIME}.{infile_name}{Tar.CODECS[args.codec]}"
+        tarobj = Tar(
+            args.path,
+            os.path.join(dst_path, archive_name),
+            args.codec,
+            args.level,
+            args.jobs,
+        )
+        print("Making archive")
+        tarobj.compress()
 
-    print("Storing archive")
-    os.rename(archive_path, full_path)
-    print(f". {archive_name} -> {full_path.replace(HOME, '~')}")
+    full_path = os.path.join(dst_path, archive_name)
+    print(f". created {full_path.replace(HOME, '~')}")
 
     print("Done")
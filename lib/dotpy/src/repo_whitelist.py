@@ -1,7 +1,57 @@
 import argparse
+import concurrent.futures
+import hashlib
+import json
 import os
 
-from . import WHITELIST, WHITELISTPATH, HashCap, TextIO, announce, pipe_command
+from .. import src
+from . import (
+    WHITELIST,
+    WHITELISTCACHE,
+    WHITELISTPATH,
+    AtomicWrite,
+    HashCache,
+    HashCap,
+    TextIO,
+    announce,
+    pipe_command,
+)
+
+
+def _digest(item, cache):
+    """Digest a file, or every python file under a directory, along
+    with their paths, which vulture's output refers to.
+
+    :param item:    Path to the file or directory.
+    :param cache:   ``HashCache`` to look digests of files up in.
+    :return:        Hex digest of the item.
+    """
+    paths = [item]
+    if os.path.isdir(item):
+        paths = sorted(
+            os.path.join(root, file)
+            for root, _, files in os.walk(item)
+            for file in files
+            if file.endswith(".py")
+        )
+
+    blake2b = hashlib.blake2b()
+    for path in paths:
+        hashcap = HashCap(path, cache=cache)
+        hashcap.hash_file()
+        blake2b.update(f"{path}\0{hashcap.snapshot[-1]}\0".encode())
+
+    return blake2b.hexdigest()
+
+
+def _whitelist(executable, item):
+    """Make vulture's whitelist for one item.
+
+    :param executable:  Path to the venv executable to run vulture with.
+    :param item:        File or directory to scan.
+    :return:            List of the lines vulture output.
+    """
+    return pipe_command(executable, item, "--make-whitelist")
 
 
 def main():
@@ -19,20 +69,61 @@ def main():
         action="store",
         help="path to venv executable",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of vulture processes to run at once",
+    )
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
     print(f"updating `{WHITELIST}'")
-    stdout = []
-    hashcap = HashCap(WHITELISTPATH)
     pathio = TextIO(WHITELISTPATH)
-    if os.path.isfile(WHITELISTPATH):
-        hashcap.hash_file()
+
+    # vulture's output for each item keyed by its path, kept while the
+    # item's content and the executable are the same
+    cachepath = os.path.join(src.CONFIGDIR, WHITELISTCACHE)
+    try:
+        with open(cachepath) as fin:
+            cached = json.load(fin)
+
+    except (OSError, ValueError):
+        cached = {}
+
+    hashcache = HashCache(defer=True)
+    items = [i for i in args.files if os.path.exists(i)]
+    keys = {i: f"{args.executable}\0{_digest(i, hashcache)}" for i in items}
+    hashcache.write()
+    stale = [
+        i
+        for i in items
+        if cached.get(os.path.abspath(i), [None])[0] != keys[i]
+    ]
+
+    # each item is analysed on its own, so they are run separately, but
+    # at the same time
+    with concurrent.futures.ThreadPoolExecutor(args.jobs) as executor:
+        outputs = executor.map(
+            _whitelist, [args.executable] * len(stale), stale
+        )
+        fresh = dict(zip(stale, outputs))
 
     # append whitelist exceptions for each individual module
-    for item in args.files:
-        if os.path.exists(item):
-            stdout.extend(
-                pipe_command(args.executable, item, "--make-whitelist")
-            )
+    stdout = []
+    results = {}
+    for item in items:
+        path = os.path.abspath(item)
+        output = fresh[item] if item in fresh else cached[path][1]
+        results[path] = [keys[item], output]
+        stdout.extend(output)
+
+    if results != cached:
+        with AtomicWrite(cachepath) as fout:
+            json.dump(results, fout)
 
     # merge the prepended PyInspection line to the beginning of every
     # entry
@@ -41,4 +132,4 @@ def main():
     # clear contents of instantiated `TextIO' object to write a new file
     # and not append
     pathio.write(*lines)
-    announce(hashcap, WHITELIST)
+    announce(pathio, WHITELIST)
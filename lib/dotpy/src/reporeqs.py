@@ -1,18 +1,57 @@
 import argparse
+import json
 import os
-import subprocess
 
+from .. import src
 from . import (
     REQUIREMENTS,
+    REQSTATE,
     LOCKPATH,
     REQPATH,
+    AtomicWrite,
+    HashCache,
     HashCap,
     TextIO,
     announce,
-    pipe_command,
 )
 
 
+def _requirement(name, package):
+    """Make a requirement line from a package in ``Pipfile.lock``,
+    without its markers.
+
+    :param name:    Name of the package.
+    :param package: The package's entry in the lock.
+    :return:        Requirement as a ``str``.
+    """
+    if package.get("extras"):
+        name += f"[{','.join(sorted(package['extras']))}]"
+
+    if "version" in package:
+        return name + package["version"]
+
+    for vcs in ("git", "hg", "svn", "bzr"):
+        if vcs in package:
+            ref = f"@{package['ref']}" if "ref" in package else ""
+            line = f"{vcs}+{package[vcs]}{ref}#egg={name}"
+            break
+
+    else:
+        line = package.get("path", package.get("file", name))
+
+    return f"-e {line}" if package.get("editable") else line
+
+
+def _digest(path, cache):
+    # digest of a file, looked up in and added to the shared cache
+    if not os.path.isfile(path):
+        return None
+
+    hashcap = HashCap(path, cache=cache)
+    hashcap.hash_file()
+    return hashcap.snapshot[-1]
+
+
 def main():
     """Create or update and then format ``requirements.txt`` from
     ``Pipfile.lock``.
@@ -22,25 +61,43 @@ def main():
         "-e",
         "--executable",
         action="store",
-        help="path to venv executable",
+        help="ignored, the lock is read without one",
     )
-    args = parser.parse_args()
+    parser.parse_args()
     print(f"updating `{REQUIREMENTS}'")
-    hashcap = HashCap(REQUIREMENTS)
-    if os.path.isfile(REQUIREMENTS):
-        hashcap.hash_file()
+    with open(LOCKPATH) as fin:
+        lock = json.load(fin)
 
-    # get the stdout for both production and development packages
-    stdout = pipe_command(args.executable, LOCKPATH)
-    stdout += pipe_command(args.executable, "--dev", LOCKPATH)
+    # nothing to do if the lock and requirements.txt are what they were
+    # the last time one was made from the other
+    statepath = os.path.join(src.CONFIGDIR, REQSTATE)
+    try:
+        with open(statepath) as fin:
+            state = json.load(fin)
 
-    # write to file and then use sed to remove the additional
-    # information following the semi-colon
+    except (OSError, ValueError):
+        state = {}
+
+    hashcache = HashCache()
+    current = [lock["_meta"]["hash"], _digest(REQPATH, hashcache)]
+    if state.get(os.path.abspath(REQPATH)) == current:
+        print(f"`{REQUIREMENTS}' is already up to date")
+        return
+
+    # both production and development packages
     reqpathio = TextIO(REQPATH)
-    reqpathio.write(*stdout)
-    reqpathio.sort()
-    reqpathio.deduplicate()
+    reqpathio.lines = [
+        _requirement(name, package)
+        for section in ("default", "develop")
+        for name, package in lock.get(section, {}).items()
+    ]
+    reqpathio.sort_unique()
     reqpathio.write()
-    # noinspection SubprocessShellMode
-    subprocess.call("sed -i 's/;.*//' " + REQPATH, shell=True)
-    announce(hashcap, REQUIREMENTS)
+    announce(reqpathio, REQUIREMENTS)
+
+    state[os.path.abspath(REQPATH)] = [
+        current[0],
+        _digest(REQPATH, hashcache),
+    ]
+    with AtomicWrite(statepath) as fout:
+        json.dump(state, fout)
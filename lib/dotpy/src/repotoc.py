@@ -5,7 +5,6 @@ from . import (
     PACKAGENAME,
     DOCS,
     REPOPATH,
-    HashCap,
     Index,
     TextIO,
     announce,
@@ -22,18 +21,12 @@ def main():
 
     print(f"updating `{mastertoc}'")
     lines = []
-    hashcap = HashCap(tocpath)
-    if os.path.isfile(tocpath):
-        hashcap.hash_file()
-
     idx = Index(package)
 
-    idx.walk_dirs()
-
     # compile a list of modules for Sphinx to document and sort them
     # e.g. [..automodule:: <PACKAGENAME>.src.<MODULE>, ...]
     if os.path.isdir(srcpath):
-        files = sorted([f".. automodule:: {i}" for i in idx.file_paths])
+        files = sorted(f".. automodule:: {i}" for i in idx.modules())
 
         # add the additional toctree properties for each listed module
         lines.extend(
@@ -54,4 +47,4 @@ def main():
         lines.append(lines.pop().strip())
     rstio = TextIO(tocpath)
     rstio.write(*lines)
-    announce(hashcap, mastertoc)
+    announce(rstio, mastertoc)
@@ -198,7 +198,6 @@ SPHINXBUILD="$VENVBIN/sphinx-build"
 MYPY="$VENVBIN/mypy"
 VULTURE="$VENVBIN/vulture"
 CODECOV="$VENVBIN/codecov"
-PIPFILE2REQ="$VENVBIN/pipfile2req"
 
 # --- "./bin" ---
 MKARCHIVE="$SCRIPTS/mkarchive"
@@ -810,14 +809,12 @@ whitelist () {
 # delim. Sort `requirements.txt' and remove duplicates. Notify user that
 # all went well.
 # Globals:
-#   PIPFILE2REQ
-#   PYITEMS
+#   REPOREQS
 # Returns:
 #   `0' if all goes ok
 # ======================================================================
 pipfile_to_requirements () {
-  check_reqs "$PIPFILE2REQ" --dev
-  "$REPOREQS" --executable "$PIPFILE2REQ"
+  "$REPOREQS"
 }
 
 
@@ -964,9 +961,33 @@ install () {
 }
 
 
+# ======================================================================
+# Run `dotpy' subcommands in a single Python process. Pass `run' followed
+# by each subcommand and its arguments, separated by a lone `+', to run
+# several in turn.
+# Globals:
+#   LIB
+#   PYTHONPATH
+# Arguments:
+#   Subcommand(s) and their arguments
+# Outputs:
+#   Output of the subcommand(s)
+# Returns:
+#   `0' if all goes ok, otherwise the exit code of the first subcommand
+#   that fails
+# ======================================================================
+dotpy () {
+  PYTHONPATH="$LIB${PYTHONPATH:+:$PYTHONPATH}" python3 -m dotpy "$@"
+}
+
+
 # ======================================================================
 # Build all the project files one after the other. This will prevent
-# checking that a `pipenv' executable is present every time.
+# checking that a `pipenv' executable is present every time. Run every
+# generator in the same `dotpy' process so startup is only paid once.
+# Globals:
+#   VULTURE
+#   PYITEMS
 # Arguments:
 #   None
 # Outputs:
@@ -976,7 +997,9 @@ install () {
 #   `0' if everything is OK
 # =====================================================================
 make_files () {
-  whitelist || return "$?"
-  "$REPOTOC" || return "$?"
-  pipfile_to_requirements || return "$?"
+  check_reqs "$VULTURE" --dev
+  dotpy run \
+      repo_whitelist --executable "$VULTURE" --files "${PYITEMS[@]}" \
+      + repotoc \
+      + reporeqs
 }
@@ -2,10 +2,17 @@
 tests._test.py
 ==============
 """
+import hashlib
+import json
 import os
+import subprocess
 import sys
+import tarfile
+
+import pytest
 
 import dotpy
+from dotpy import __main__
 
 from . import expected
 
@@ -79,10 +86,244 @@ def test_backups(nocolorcapsys, suffix):
                             constant so as to ensure a match.
     """
     test_output(nocolorcapsys)
+    sys.argv.append("--relink")
     out = install(nocolorcapsys)
     assert out == expected.backups(dotpy.install.HOME, suffix)
 
 
+def test_up_to_date(nocolorcapsys):
+    """Test that a second run leaves links that are already correct
+    alone and only reports how many there were.
+
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    """
+    test_output(nocolorcapsys)
+    freeze_dir = sorted(os.listdir(dotpy.install.HOME))
+    out = install(nocolorcapsys)
+    assert out == f"{len(expected.PAIRS)} up to date\n"
+    assert sorted(os.listdir(dotpy.install.HOME)) == freeze_dir
+
+
+def test_jobs(nocolorcapsys):
+    """Test that linking groups concurrently gives the same links and
+    the same, ordered, output as linking them one after the other.
+
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    """
+    sys.argv.extend(["--jobs", "4"])
+    out = install(nocolorcapsys)
+    assert out == expected.output(dotpy.install.HOME)
+    for val in expected.PAIRS.values():
+        assert os.path.islink(os.path.join(dotpy.install.HOME, val))
+
+
+def test_state(nocolorcapsys, monkeypatch):
+    """Test that every link is recorded in the state file and that a
+    re-run trusts the state rather than listing any directories.
+
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    """
+    install(nocolorcapsys)
+    statepath = os.path.join(dotpy.install.CONFIGDIR, dotpy.STATE)
+    with open(statepath) as fin:
+        state = json.load(fin)
+
+    assert len(state["links"]) == len(expected.PAIRS)
+    scanned = []
+    monkeypatch.setattr(dotpy.install.os, "scandir", scanned.append)
+    out = install(nocolorcapsys)
+    assert out == f"{len(expected.PAIRS)} up to date\n"
+    assert not scanned
+
+
+def test_state_repairs(nocolorcapsys):
+    """Test that a link recorded in the state is still relinked if it
+    was removed or replaced since the last install.
+
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    """
+    install(nocolorcapsys)
+    removed, replaced = [
+        os.path.join(dotpy.install.HOME, v) for v in expected.FOLLOW_PATH
+    ][:2]
+    source = os.readlink(replaced)
+    os.remove(removed)
+    os.remove(replaced)
+    with open(replaced, "w") as fout:
+        fout.write("not a link")
+
+    out = install(nocolorcapsys)
+    assert f"{len(expected.PAIRS) - 2} up to date" in out
+    assert os.path.islink(removed)
+    assert os.readlink(replaced) == source
+
+
+def test_source_key(nocolorcapsys):
+    """Test that the key of the source tree changes when a file is added
+    to a nested directory and not only to the top level.
+
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    """
+    install(nocolorcapsys)
+    conf = dotpy.Yaml(dotpy.install.CONFIG)
+    conf.read()
+    key = dotpy.install.source_key(conf.dict)
+    nested = sorted(
+        {
+            os.path.dirname(s)
+            for group in dotpy.install.link_groups(conf.dict)
+            for s, _ in group
+        }
+        - {dotpy.install.source_dir()}
+    )[0]
+    mtime = os.stat(nested).st_mtime_ns - 10 ** 9
+    os.utime(nested, ns=(mtime, mtime))
+    assert dotpy.install.source_key(conf.dict) != key
+
+
+def test_status(nocolorcapsys):
+    """Test that ``--status`` reports the links from the last install
+    and changes nothing.
+
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    """
+    sys.argv.append("--status")
+    assert install(nocolorcapsys) == "nothing has been installed yet\n"
+    sys.argv.remove("--status")
+    install(nocolorcapsys)
+    freeze_dir = sorted(os.listdir(dotpy.install.HOME))
+    sys.argv.append("--status")
+    out = install(nocolorcapsys).splitlines()
+    assert len(out) == len(expected.PAIRS) + 1
+    assert out[-1] == f"{len(expected.PAIRS)} managed links"
+    assert sorted(os.listdir(dotpy.install.HOME)) == freeze_dir
+
+
+def _fail_install(nocolorcapsys, monkeypatch):
+    # let a few links through and then fail as if the disk were full
+    symlink = os.symlink
+    calls = []
+
+    def _symlink(source, dest):
+        calls.append(dest)
+        if len(calls) > 3:
+            raise OSError(28, "No space left on device")
+
+        symlink(source, dest)
+
+    monkeypatch.setattr(dotpy.install.os, "symlink", _symlink)
+    with pytest.raises(SystemExit):
+        install(nocolorcapsys)
+
+    nocolorcapsys.readouterr()
+    monkeypatch.setattr(dotpy.install.os, "symlink", symlink)
+    assert os.path.isfile(
+        os.path.join(dotpy.install.CONFIGDIR, dotpy.JOURNAL)
+    )
+
+
+def test_rollback(nocolorcapsys, monkeypatch):
+    """Test that a failed install, including its backups, can be
+    rolled back to exactly how things were before it started.
+
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    """
+    bashrc = os.path.join(dotpy.install.HOME, ".bashrc")
+    with open(bashrc, "w") as fout:
+        fout.write("# existing bashrc\n")
+
+    freeze_dir = sorted(os.listdir(dotpy.install.HOME))
+    _fail_install(nocolorcapsys, monkeypatch)
+    sys.argv.append("--rollback")
+    install(nocolorcapsys)
+    assert sorted(os.listdir(dotpy.install.HOME)) == freeze_dir
+    assert not os.path.islink(bashrc)
+    assert not os.path.exists(
+        os.path.join(dotpy.install.CONFIGDIR, dotpy.JOURNAL)
+    )
+
+
+def test_resume(nocolorcapsys, monkeypatch):
+    """Test that a failed install refuses to run again until it is
+    resumed and that resuming it links everything that was left.
+
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    """
+    _fail_install(nocolorcapsys, monkeypatch)
+    with pytest.raises(SystemExit):
+        install(nocolorcapsys)
+
+    sys.argv.append("--resume")
+    out = install(nocolorcapsys)
+    assert out == "".join(
+        expected.output(dotpy.install.HOME).splitlines(True)[3:]
+    )
+    for val in expected.PAIRS.values():
+        assert os.path.islink(os.path.join(dotpy.install.HOME, val))
+
+
+def test_backup_store(nocolorcapsys):
+    """Test that backups moved into the store are taken out of
+    ``$HOME`` and that identical backups are only stored once.
+
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    """
+    for name in (".bashrc", ".gitconfig"):
+        with open(os.path.join(dotpy.install.HOME, name), "w") as fout:
+            fout.write("# same\n")
+
+    sys.argv.append("--store")
+    install(nocolorcapsys)
+    store = os.path.join(dotpy.install.CONFIGDIR, dotpy.BACKUPS)
+    assert len(os.listdir(os.path.join(store, "objects"))) == 1
+    with open(os.path.join(store, "index.json")) as fin:
+        assert len(json.load(fin)) == 2
+
+    assert not [
+        i for i in os.listdir(dotpy.install.HOME) if i.endswith(dotpy.SUFFIX)
+    ]
+    sys.argv.remove("--store")
+    sys.argv.extend(["--restore", os.path.join(dotpy.install.HOME, ".bashrc")])
+    restored = install(nocolorcapsys).strip()
+    with open(restored) as fin:
+        assert fin.read() == "# same\n"
+
+
+def test_backup_gc(nocolorcapsys):
+    """Test that ``--gc`` moves backups left by earlier installs into
+    the store and keeps only the last of them with ``--keep 1``.
+
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    """
+    install(nocolorcapsys)
+    for suffix in ("01012020T000000", "02012020T000000"):
+        path = os.path.join(dotpy.install.HOME, f".bashrc.{suffix}")
+        with open(path, "w") as fout:
+            fout.write(f"# {suffix}\n")
+
+    sys.argv.extend(["--gc", "--keep", "1"])
+    out = install(nocolorcapsys)
+    assert out.splitlines()[-1] == "1 backups stored, 1 removed"
+    assert not [i for i in os.listdir(dotpy.install.HOME) if "2020T" in i]
+    objects = os.path.join(dotpy.install.CONFIGDIR, dotpy.BACKUPS, "objects")
+    (obj,) = os.listdir(objects)
+    with open(os.path.join(objects, obj)) as fin:
+        assert fin.read() == "# 02012020T000000\n"
+
+
 def test_dry_run(nocolorcapsys):
     """Test that the actual output informing the user of the process,
     including the notice that this is a dry-run, matches the expected
@@ -111,7 +352,7 @@ def test_dry_run_backups(nocolorcapsys, suffix):
     :param suffix:
     """
     test_output(nocolorcapsys)
-    sys.argv.append("--dry")
+    sys.argv.extend(["--dry", "--relink"])
     freeze_dir = os.listdir(dotpy.install.HOME)
     out = install(nocolorcapsys)
     assert out == expected.dry_run_backups(dotpy.install.HOME, suffix)
@@ -130,3 +371,921 @@ def test_broken_symlink(nocolorcapsys):
     vimrc = os.path.join(dotpy.install.HOME, ".vim", "vimrc")
     os.remove(vimrc)  # break link
     install(nocolorcapsys)
+
+
+def test_plan_scans_each_dir_once(nocolorcapsys, monkeypatch):
+    """Test that building the plan lists every destination directory
+    only once, however many dotfiles are linked into it.
+
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    """
+    scanned = []
+    scandir = os.scandir
+
+    def _scandir(path):
+        scanned.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(dotpy.install.os, "scandir", _scandir)
+    out = install(nocolorcapsys)
+    assert out == expected.output(dotpy.install.HOME)
+    assert len(scanned) == len(set(scanned))
+
+
+def test_yaml_cache(tmpdir, monkeypatch):
+    """Test that an unchanged yaml file is loaded from its cache without
+    being parsed and that a changed one is parsed again.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    """
+    path = os.path.join(tmpdir, "conf.yaml")
+    with open(path, "w") as fout:
+        fout.write("key: value\n")
+
+    conf = dotpy.Yaml(path)
+    conf.read()
+    assert conf.dict == {"key": "value"}
+
+    def _load(*_, **__):
+        raise AssertionError("unchanged file parsed again")
+
+    with monkeypatch.context() as context:
+        context.setattr("yaml.load", _load)
+        conf = dotpy.Yaml(path)
+        conf.read()
+        assert conf.dict == {"key": "value"}
+
+    with open(path, "w") as fout:
+        fout.write("key: other\n")
+
+    conf = dotpy.Yaml(path)
+    conf.read()
+    assert conf.dict == {"key": "other"}
+
+    # an edit of the same size within the same mtime is still noticed
+    mtime = os.stat(path).st_mtime_ns
+    with open(path, "w") as fout:
+        fout.write("key: again\n")
+
+    os.utime(path, ns=(mtime, mtime))
+    conf = dotpy.Yaml(path)
+    conf.read()
+    assert conf.dict == {"key": "again"}
+
+
+def test_import_time():
+    """Test, with ``-X importtime``, that running a light subcommand
+    such as ``reponame`` does not import the modules only the heavier
+    subcommands need.
+    """
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(dotpy.PYLIB))
+    code = "import sys, dotpy; dotpy.reponame; print(*sys.modules)"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    imported = {
+        line.split("|")[-1].strip()
+        for line in proc.stderr.decode().splitlines()
+        if line.startswith("import time:")
+    }
+    imported.update(proc.stdout.decode().split())
+    assert "dotpy.src.reponame" in imported
+    for module in (
+        "appdirs",
+        "yaml",
+        "tarfile",
+        "hashlib",
+        "subprocess",
+        "concurrent.futures",
+    ):
+        assert module not in imported
+
+
+def test_run(nocolorcapsys):
+    """Test that ``python -m dotpy run`` runs each subcommand, with its
+    own args, in turn.
+
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    """
+    assert __main__.split(["reponame", "+", "docs-title", "-r", "x"]) == [
+        ["reponame"],
+        ["docs_title", "-r", "x"],
+    ]
+
+    # an argument naming a subcommand is not the start of another
+    assert __main__.split(["docs-title", "-r", "install"]) == [
+        ["docs_title", "-r", "install"]
+    ]
+    for args in (["reponame", "+"], ["-r", "x"]):
+        with pytest.raises(SystemExit):
+            __main__.split(args)
+
+    sys.argv = ["dotpy", "run", "reponame", "+", "reponame"]
+    __main__.main()
+    name = dotpy.reponame.main(echo=False)
+    assert nocolorcapsys.stdout() == f"{name}\n{name}\n"
+
+
+@pytest.mark.parametrize(
+    "codec,level,jobs",
+    [
+        ("gz", None, 1),
+        ("gz", 1, 4),
+        ("bz2", 1, 1),
+        ("xz", 1, 1),
+        ("none", None, 1),
+    ],
+)
+def test_tar_codecs(tmpdir, monkeypatch, codec, level, jobs):
+    """Test that every codec, including gzip compressed in parallel as
+    independent members, makes an archive that extracts to the same
+    files.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    :param codec:           Codec to compress with.
+    :param level:           Compression level.
+    :param jobs:            Number of threads to compress with.
+    """
+    monkeypatch.chdir(tmpdir)
+    os.mkdir("src")
+    contents = {f"{i}.txt": f"{i} " * (i * 4096) for i in range(64)}
+    for name, content in contents.items():
+        with open(os.path.join("src", name), "w") as fout:
+            fout.write(content)
+
+    archive = "archive" + dotpy.Tar.CODECS[codec]
+    tarobj = dotpy.Tar("src", archive, level=level, jobs=jobs)
+    assert tarobj.codec == codec
+    tarobj.compress()
+    os.rename("src", "old")
+    tarobj.extract()
+    for name, content in contents.items():
+        with open(os.path.join("src", name)) as fin:
+            assert fin.read() == content
+
+
+@pytest.fixture(name="fake_gpg")
+def fixture_fake_gpg(tmpdir, monkeypatch):
+    """Put a stand-in for ``gpg`` on ``PATH`` that "encrypts" stdin to
+    ``--output`` and "decrypts" its last argument to stdout unchanged.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    """
+    bindir = os.path.join(tmpdir, "bin")
+    os.mkdir(bindir)
+    gpg = os.path.join(bindir, "gpg")
+    with open(gpg, "w") as fout:
+        fout.write(
+            "#!/bin/sh\n"
+            'for arg; do last="$arg"; done\n'
+            'case "$*" in\n'
+            '  *--decrypt*) cat "$last" ;;\n'
+            '  *) cat > "$3" ;;\n'
+            "esac\n"
+        )
+
+    os.chmod(gpg, 0o755)
+    monkeypatch.setenv("PATH", bindir + os.pathsep + os.environ["PATH"])
+
+
+def test_cryptdir(tmpdir, monkeypatch, fake_gpg):
+    """Test that ``cryptdir`` archives straight into ``gpg`` without
+    writing a plaintext archive and that ``--decrypt`` extracts what
+    ``gpg`` gives back.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    :param fake_gpg:        Stand-in ``gpg`` on ``PATH``.
+    """
+    del fake_gpg
+    monkeypatch.chdir(tmpdir)
+    os.mkdir("secret")
+    with open(os.path.join("secret", "file"), "w") as fout:
+        fout.write("plaintext\n")
+
+    sys.argv = ["cryptdir", "secret"]
+    dotpy.cryptdir.main()
+    assert os.path.isfile("secret.tar.gz.gpg")
+    assert not os.path.exists("secret.tar.gz")
+    assert not os.path.exists("secret")
+    sys.argv = ["cryptdir", "--decrypt", "secret.tar.gz.gpg"]
+    dotpy.cryptdir.main()
+    with open(os.path.join("secret", "file")) as fin:
+        assert fin.read() == "plaintext\n"
+
+
+def test_cryptdir_batch(tmpdir, monkeypatch, nocolorcapsys, fake_gpg):
+    """Test that ``cryptdir`` encrypts every path and glob it is given
+    on a pool of processes and reports a summary.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    :param fake_gpg:        Stand-in ``gpg`` on ``PATH``.
+    """
+    del fake_gpg
+    monkeypatch.chdir(tmpdir)
+    names = ["one", "two", "three"]
+    for name in names:
+        os.mkdir(name)
+        with open(os.path.join(name, "file"), "w") as fout:
+            fout.write(name)
+
+    sys.argv = ["cryptdir", "one", "t*", "--jobs", "2"]
+    dotpy.cryptdir.main()
+    assert "Done: 3 ok, 0 failed" in nocolorcapsys.readouterr()[0]
+    for name in names:
+        assert os.path.isfile(f"{name}.tar.gz.gpg")
+        assert not os.path.exists(name)
+
+    sys.argv = ["cryptdir", "--decrypt", "*.gpg"]
+    dotpy.cryptdir.main()
+    for name in names:
+        with open(os.path.join(name, "file")) as fin:
+            assert fin.read() == name
+
+
+def test_cryptdir_failures(tmpdir, monkeypatch, nocolorcapsys, fake_gpg):
+    """Test that a path which fails, whether archiving it or extracting
+    a member that is refused, is reported in the summary while the rest
+    of the batch carries on, and that a failed archive leaves nothing
+    behind.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    :param fake_gpg:        Stand-in ``gpg`` on ``PATH``.
+    """
+    del fake_gpg
+    monkeypatch.chdir(tmpdir)
+    os.mkdir("secret")
+    with open(os.path.join("secret", "file"), "w") as fout:
+        fout.write("plaintext\n")
+
+    def _compress(_, fileobj=None):
+        fileobj.write(b"partial")
+        raise OSError(28, "No space left on device")
+
+    with monkeypatch.context() as context:
+        context.setattr(dotpy.Tar, "compress", _compress)
+        sys.argv = ["cryptdir", "secret", "--jobs", "1"]
+        with pytest.raises(SystemExit):
+            dotpy.cryptdir.main()
+
+    assert "Done: 0 ok, 1 failed" in nocolorcapsys.readouterr()[0]
+    assert not os.path.exists("secret.tar.gz.gpg")
+    assert os.path.isfile(os.path.join("secret", "file"))
+
+    sys.argv = ["cryptdir", "secret"]
+    dotpy.cryptdir.main()
+    with tarfile.open("evil.tar.gz.gpg", "w:gz") as tar:
+        tar.add(os.path.join(tmpdir, "bin", "gpg"), "../evil")
+
+    sys.argv = ["cryptdir", "--decrypt", "*.gpg", "--jobs", "1"]
+    with pytest.raises(SystemExit):
+        dotpy.cryptdir.main()
+
+    assert "Done: 1 ok, 1 failed" in nocolorcapsys.readouterr()[0]
+    assert not os.path.exists(os.path.join(os.path.dirname(tmpdir), "evil"))
+    with open(os.path.join("secret", "file")) as fin:
+        assert fin.read() == "plaintext\n"
+
+
+def test_mkarchive_incremental(tmpdir, monkeypatch, nocolorcapsys):
+    """Test that incremental archives only hold what changed and that
+    restoring the chain gives back the source as it was last archived.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    """
+    monkeypatch.chdir(tmpdir)
+    src = os.path.join(tmpdir, "src")
+    for name in ("keep", "change", "remove", os.path.join("dir", "file")):
+        path = os.path.join(src, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fout:
+            fout.write(name)
+
+    argv = ["mkarchive", "src", "--dest", "archive", "--incremental"]
+    sys.argv = argv
+    dotpy.mkarchive.main()
+    assert "full archive: 5 added, 0 deleted" in nocolorcapsys.readouterr()[0]
+    dotpy.mkarchive.main()
+    assert "No changes" in nocolorcapsys.readouterr()[0]
+
+    with open(os.path.join(src, "change"), "w") as fout:
+        fout.write("changed")
+
+    os.remove(os.path.join(src, "remove"))
+    os.remove(os.path.join(src, "dir", "file"))
+    os.rmdir(os.path.join(src, "dir"))
+    with open(os.path.join(src, "dir"), "w") as fout:
+        fout.write("dir")
+
+    dotpy.mkarchive.main()
+    out = nocolorcapsys.readouterr()[0]
+    assert "incremental archive: 2 added, 3 deleted" in out
+
+    sys.argv = argv[:4] + ["--restore", "restored"]
+    dotpy.mkarchive.main()
+    restored = os.path.join("restored", src.lstrip(os.sep))
+    assert sorted(os.listdir(restored)) == ["change", "dir", "keep"]
+    for name, content in (("change", "changed"), ("dir", "dir")):
+        with open(os.path.join(restored, name)) as fin:
+            assert fin.read() == content
+
+
+def test_mkarchive_store(tmpdir, monkeypatch, nocolorcapsys):
+    """Test that snapshots in the store share unchanged chunks and that
+    any snapshot can be restored.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    """
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(dotpy.mkarchive.ChunkStore, "CHUNK", 1024)
+    src = os.path.join(tmpdir, "src")
+    os.makedirs(os.path.join(src, "dir"))
+    os.symlink("big", os.path.join(src, "link"))
+    with open(os.path.join(src, "big"), "wb") as fout:
+        fout.write(os.urandom(64 * 1024))
+
+    def stored(suffix):
+        monkeypatch.setattr(dotpy.mkarchive, "SUFFIX", suffix)
+        sys.argv = ["mkarchive", "src", "--dest", "archive", "--store"]
+        dotpy.mkarchive.main()
+        out = nocolorcapsys.readouterr()[0]
+        return int(out.split(": ")[1].split()[0])
+
+    assert stored("01012020T000000") > 64 * 1024
+    with open(os.path.join(src, "big"), "r+b") as fout:
+        fout.write(b"changed")
+
+    assert stored("02012020T000000") < 2 * 1024
+    with open(os.path.join(src, "big"), "r+b") as fout:
+        fout.write(b"again")
+
+    # a second snapshot within the same second does not replace the first
+    assert stored("02012020T000000") < 2 * 1024
+    store = dotpy.mkarchive.ChunkStore(os.path.join("archive", ".store"))
+    assert [os.path.basename(p) for p in store.snapshots("src")] == [
+        "01012020T000000.json",
+        "02012020T000000.json",
+        "02012020T000000-1.json",
+    ]
+    sys.argv = ["mkarchive", "src", "-d", "archive", "-s", "-r", "restored"]
+    dotpy.mkarchive.main()
+    restored = os.path.join("restored", src.lstrip(os.sep))
+    assert os.readlink(os.path.join(restored, "link")) == "big"
+    assert os.path.isdir(os.path.join(restored, "dir"))
+    with open(os.path.join(restored, "big"), "rb") as fin:
+        assert fin.read(7) == b"agained"
+
+    sys.argv.extend(["--snapshot", "01012020T000000"])
+    dotpy.mkarchive.main()
+    with open(os.path.join(restored, "big"), "rb") as fin:
+        assert fin.read(7) not in (b"changed", b"agained")
+
+    # a chunk which does not match its digest is not restored
+    first, second = list(store.index)[:2]
+    store.index[first] = store.index[second]
+    store.close()
+    with pytest.raises(ValueError, match=first):
+        dotpy.mkarchive.main()
+
+
+@pytest.mark.parametrize("codec", ["gz", "none", "xz"])
+def test_tar_extract_members(tmpdir, monkeypatch, codec):
+    """Test that named members can be extracted on their own, seeking
+    to them with the index written beside gz and uncompressed archives.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    :param codec:           Codec to compress with.
+    """
+    monkeypatch.chdir(tmpdir)
+    os.makedirs(os.path.join("src", "dir"))
+    contents = {f"{i}.txt": os.urandom(i * 1000).hex() for i in range(64)}
+    contents[os.path.join("dir", "file")] = "file"
+    for name, content in contents.items():
+        with open(os.path.join("src", name), "w") as fout:
+            fout.write(content)
+
+    archive = "archive" + dotpy.Tar.CODECS[codec]
+    tarobj = dotpy.Tar("src", archive, codec, level=1, jobs=2)
+    tarobj.compress()
+    assert os.path.isfile(tarobj.index) == (codec != "xz")
+    os.rename("src", "old")
+    wanted = ["src/63.txt", "src/dir"]
+    assert tarobj.extract(members=wanted) == len(contents["63.txt"]) + 4
+    assert sorted(os.listdir("src")) == ["63.txt", "dir"]
+    for name in ("63.txt", os.path.join("dir", "file")):
+        with open(os.path.join("src", name)) as fin:
+            assert fin.read() == contents[name]
+
+
+def test_tar_extract_dest(tmpdir, monkeypatch):
+    """Test that archives extract into a given dir, filtered by glob
+    patterns, and that members which would land outside it are refused.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    """
+    monkeypatch.chdir(tmpdir)
+    os.makedirs(os.path.join("src", "dir"))
+    for name in ("a.py", "b.py", "c.txt", os.path.join("dir", "d.py")):
+        with open(os.path.join("src", name), "w") as fout:
+            fout.write(name)
+
+    tarobj = dotpy.Tar("src", "archive.tar.gz", jobs=4)
+    tarobj.compress()
+    tarobj.extract(dest="out", include=["*.py"], exclude=["*/b.py"])
+    out = os.path.join("out", "src")
+    assert sorted(os.listdir(out)) == ["a.py", "dir"]
+    with open(os.path.join(out, "dir", "d.py")) as fin:
+        assert fin.read() == os.path.join("dir", "d.py")
+
+    with tarfile.open("evil.tar", "w") as tar:
+        tar.add(os.path.join("src", "a.py"), arcname="../evil.py")
+
+    with pytest.raises(tarfile.TarError):
+        dotpy.Tar(None, "evil.tar").extract(dest="out")
+
+    assert not os.path.exists("evil.py")
+
+
+def test_tar_extract_large(tmpdir, monkeypatch):
+    """Test that members over a MiB are copied to disk in chunks rather
+    than read whole, alongside small ones written on the pool.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    """
+    monkeypatch.chdir(tmpdir)
+    os.mkdir("src")
+    contents = {f"{i}.bin": os.urandom(i * 1024) for i in range(1, 5)}
+    contents.update(
+        {f"{i}.bin": os.urandom((1 << 20) + i) for i in range(5, 7)}
+    )
+    for name, content in contents.items():
+        with open(os.path.join("src", name), "wb") as fout:
+            fout.write(content)
+
+    tarobj = dotpy.Tar("src", "archive.tar.gz", jobs=2)
+    tarobj.compress()
+    read = tarfile.ExFileObject.read
+    reads = []
+
+    def _read(self, size=-1):
+        reads.append(size)
+        return read(self, size)
+
+    monkeypatch.setattr(tarfile.ExFileObject, "read", _read)
+    tarobj.extract(dest="out")
+    for name, content in contents.items():
+        with open(os.path.join("out", "src", name), "rb") as fin:
+            assert fin.read() == content
+
+    # only the four small members are read whole
+    assert len([size for size in reads if size in (-1, None)]) == 4
+
+
+@pytest.mark.parametrize("algorithm", ["blake2b", "sha256", "md5"])
+def test_hashcap(tmpdir, monkeypatch, algorithm):
+    """Test that ``HashCap`` hashes files in chunks and only hashes
+    them when their stat data does not settle the comparison.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    :param algorithm:       Algorithm to hash with.
+    """
+    path = os.path.join(tmpdir, "file")
+    content = os.urandom(3 * 1024 + 1)
+    with open(path, "wb") as fout:
+        fout.write(content)
+
+    monkeypatch.setattr(dotpy.HashCap, "CHUNK", 1024)
+    hashcap = dotpy.HashCap(path, algorithm)
+    hashcap.hash_file()
+    assert hashcap.snapshot == [hashlib.new(algorithm, content).hexdigest()]
+
+    # written within a second of being hashed, so hashed again
+    with open(path, "r+b") as fout:
+        fout.write(b"x")
+
+    os.utime(path, ns=(hashcap.stat[-1][1], hashcap.stat[-1][1]))
+    hashcap.hash_file()
+    assert not hashcap.compare()
+
+    os.utime(path, (0, 0))
+    hashcap.hash_file()
+
+    def digest(_):
+        raise AssertionError("hashed")
+
+    monkeypatch.setattr(dotpy.HashCap, "digest", digest)
+    hashcap.hash_file()
+    assert hashcap.compare()
+
+    with open(path, "ab") as fout:
+        fout.write(b"changed")
+
+    hashcap.hash_file()
+    assert not hashcap.compare()
+    with pytest.raises(ValueError):
+        dotpy.HashCap(path, "crc32")
+
+
+def test_hash_cache(tmpdir, monkeypatch):
+    """Test that digests kept in the ``HashCache`` under ``CONFIGDIR``
+    are used across runs until a file changes, and that the least
+    recently used are evicted.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    """
+    paths = [os.path.join(tmpdir, str(i)) for i in range(3)]
+    for path in paths:
+        with open(path, "w") as fout:
+            fout.write(path)
+
+        os.utime(path, (0, 0))
+
+    for path in paths:
+        dotpy.HashCap(path, cache=dotpy.HashCache(maxsize=2)).hash_file()
+
+    cache = os.path.join(dotpy.install.CONFIGDIR, dotpy.HASHCACHE)
+    with open(cache) as fin:
+        assert [k.split(":", 1)[1] for k in json.load(fin)] == paths[1:]
+
+    def digest(_):
+        raise AssertionError("hashed")
+
+    hashcap = dotpy.HashCap(paths[2], cache=dotpy.HashCache())
+    with monkeypatch.context() as context:
+        context.setattr(dotpy.HashCap, "digest", digest)
+        hashcap.hash_file()
+
+    with open(paths[2], "w") as fout:
+        fout.write("changed")
+
+    hashcap = dotpy.HashCap(paths[2], cache=dotpy.HashCache())
+    hashcap.hash_file()
+    assert hashcap.snapshot[0] == dotpy.HashCap(paths[2]).digest()
+
+    # hashed within a second of being written, so not trusted next time
+    with open(paths[2], "r+") as fout:
+        fout.write("CHANGED")
+
+    stat = os.stat(paths[2])
+    os.utime(paths[2], ns=(stat.st_atime_ns, hashcap.stat[-1][1]))
+    hashcap = dotpy.HashCap(paths[2], cache=dotpy.HashCache())
+    hashcap.hash_file()
+    assert hashcap.snapshot[0] == dotpy.HashCap(paths[2]).digest()
+
+
+def test_textio_unchanged(tmpdir, nocolorcapsys):
+    """Test that ``TextIO`` does not rewrite a file with the lines it
+    already holds, writes through symlinks, and that ``announce``
+    reports what happened.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    """
+    path = os.path.join(tmpdir, "text", "file.txt")
+    link = os.path.join(tmpdir, "text", "link.txt")
+    os.mkdir(os.path.dirname(path))
+    os.symlink(path, link)
+    outputs = []
+    for lines in (["a", "b"], ["a", "b"], ["b"]):
+        textio = dotpy.TextIO(link)
+        mtime = os.stat(path).st_mtime_ns if textio.existed else None
+        textio.write(*lines)
+        dotpy.announce(textio, "file.txt")
+        outputs.append(nocolorcapsys.readouterr()[0])
+        if textio.changed:
+            continue
+
+        assert os.stat(path).st_mtime_ns == mtime
+
+    assert outputs == [
+        "created `file.txt'\n",
+        "`file.txt' is already up to date\n",
+        "updated `file.txt'\n",
+    ]
+    assert os.path.islink(link)
+    assert sorted(os.listdir(os.path.dirname(path))) == [
+        "file.txt",
+        "link.txt",
+    ]
+    with open(path) as fin:
+        assert fin.read() == "b\n"
+
+
+def test_atomic_write(tmpdir):
+    """Test that ``AtomicWrite`` replaces a file only once it has been
+    written in full, keeps its mode and leaves no temporary file behind
+    whether or not the write fails.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    """
+    path = os.path.join(tmpdir, "dir", "file.txt")
+    with dotpy.AtomicWrite(path) as fout:
+        fout.write("first\n")
+
+    umask = os.umask(0)
+    os.umask(umask)
+    assert os.stat(path).st_mode & 0o777 == 0o666 & ~umask
+    os.chmod(path, 0o600)
+    with pytest.raises(RuntimeError):
+        with dotpy.AtomicWrite(path) as fout:
+            fout.write("partial")
+            raise RuntimeError
+
+    with open(path) as fin:
+        assert fin.read() == "first\n"
+
+    with dotpy.AtomicWrite(path) as fout:
+        fout.write("second\n")
+
+    with open(path) as fin:
+        assert fin.read() == "second\n"
+
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert os.listdir(os.path.dirname(path)) == ["file.txt"]
+
+
+def test_textio_unique(tmpdir):
+    """Test that ``TextIO`` de-duplicates lines keeping the first of
+    each in order, and sorts them unique in one pass.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    """
+    textio = dotpy.TextIO(os.path.join(tmpdir, "file.txt"))
+    textio.lines = ["b", "a", "b", "c", "a"]
+    textio.deduplicate()
+    assert textio.lines == ["b", "a", "c"]
+    textio.lines = ["b", "a", "b", "c", "a"]
+    textio.sort_unique()
+    assert textio.lines == ["a", "b", "c"]
+
+
+def test_textio_lazy(tmpdir, monkeypatch, nocolorcapsys):
+    """Test that a lazy ``TextIO`` reads the same lines from a mapped
+    file as an eager one, that ``docs_title`` only edits the start of
+    the README, in place if it keeps its length and otherwise through a
+    file which replaces it, and that each write unmaps the old file.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    """
+    path = os.path.join(tmpdir, "README.rst")
+    body = [f"line {i}" for i in range(10000)]
+    with open(path, "w") as fout:
+        fout.write("\n".join(["dotfiles", "========", *body]))
+
+    textio = dotpy.TextIO(path, lazy=True)
+    assert textio.lines[:2] == ["dotfiles", "========"]
+    assert textio.lines[-1] == "line 9999"
+    assert list(textio.lines) == ["dotfiles", "========", *body]
+    assert not textio.write()
+
+    monkeypatch.setattr(dotpy.docs_title, "READMEPATH", path)
+    inode = os.stat(path).st_ino
+    for title, old in (("DOTFILES", "dotfiles"), ("README", "DOTFILES")):
+        sys.argv = ["docs_title", "--replace", title]
+        dotpy.docs_title.main()
+        assert nocolorcapsys.readouterr()[0] == old + "\n"
+        with open(path) as fin:
+            assert fin.read().split("\n") == [title, len(title) * "=", *body]
+
+        assert (os.stat(path).st_ino == inode) == (title == "DOTFILES")
+
+    assert not [n for n in os.listdir(tmpdir) if n.endswith(".tmp")]
+
+    # lines end the same with \r\n and edited ones keep their ending
+    with open(path, "wb") as fout:
+        fout.write(b"title\r\n=====\r\nbody\r\n")
+
+    textio = dotpy.TextIO(path, lazy=True)
+    assert list(textio.lines) == dotpy.TextIO(path).lines
+    lines = textio.lines
+    textio.lines[0] = "other"
+    assert textio.write()
+    assert lines.mapped.closed
+    with open(path, "rb") as fin:
+        assert fin.read() == b"other\r\n=====\r\nbody\r\n"
+
+
+def test_iter_repo(tmpdir):
+    """Test that ``iter_repo`` finds the shallowest package without
+    entering ``.git``, virtual environments or ignored directories, and
+    stops at ``max_depth``.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    """
+    root = os.path.join(tmpdir, "repo")
+    for path in (
+        ".git/a/__init__.py",
+        "build/b/__init__.py",
+        "env/pyvenv.cfg",
+        "env/lib/c/__init__.py",
+        "lib/node_modules/d/__init__.py",
+        "lib/keep/e/__init__.py",
+        "src/deep/pkg/__main__.py",
+    ):
+        path = os.path.join(root, *path.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "w").close()
+
+    with open(os.path.join(root, ".gitignore"), "w") as fout:
+        fout.write("# generated\n/build/\nnode_modules\nkeep/\n!lib/keep/\n")
+
+    assert dotpy.iter_repo(root) == "e"
+    os.remove(os.path.join(root, "lib", "keep", "e", "__init__.py"))
+    assert dotpy.iter_repo(root) == "pkg"
+    assert dotpy.iter_repo(root, max_depth=2) is None
+    assert dotpy.iter_repo(os.path.join(root, "src", "deep", "pkg")) == (
+        os.path.join(root, "src", "deep", "pkg")
+    )
+    assert dotpy.iter_repo(root, ignore=False) == "b"
+
+    # ``**/`` matches at any depth and ``*`` only within a segment
+    root = os.path.join(tmpdir, "globs")
+    for path in (
+        "x/foo/bar/__init__.py",
+        "src/a/gen/__init__.py",
+        "src/a/b/gen/__init__.py",
+    ):
+        path = os.path.join(root, *path.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "w").close()
+
+    with open(os.path.join(root, ".gitignore"), "w") as fout:
+        fout.write("**/foo/bar\nsrc/*/gen\n")
+
+    assert dotpy.iter_repo(root) == "gen"
+
+
+def test_index_cache(tmpdir, monkeypatch):
+    """Test that ``Index`` yields every module and only lists the
+    directories which changed since it last did.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    """
+    monkeypatch.chdir(tmpdir)
+    for path in ("pkg/__init__.py", "pkg/a.py", "pkg/sub/b.py", "pkg/c.txt"):
+        path = os.path.join(*path.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "w").close()
+
+    # old enough for their listings to be trusted
+    for path in ("pkg", os.path.join("pkg", "sub")):
+        os.utime(path, (0, 0))
+
+    modules = ["pkg.a", "pkg.sub.b"]
+    assert sorted(dotpy.Index("pkg").modules()) == modules
+    listed = []
+    scandir = os.scandir
+
+    def counted(path):
+        listed.append(os.path.normpath(path))
+        return scandir(path)
+
+    monkeypatch.setattr(dotpy.src.os, "scandir", counted)
+    assert sorted(dotpy.Index("pkg").modules()) == modules
+    assert not listed
+
+    open(os.path.join("pkg", "sub", "d.py"), "w").close()
+    idx = dotpy.Index("pkg")
+    idx.walk_dirs()
+    assert sorted(idx.file_paths) == modules + ["pkg.sub.d"]
+    assert listed == [os.path.join("pkg", "sub")]
+
+
+def test_repo_whitelist_cache(tmpdir, monkeypatch, nocolorcapsys):
+    """Test that ``repo_whitelist`` runs vulture for every item at once
+    and only for items which changed since the last run, and refuses to
+    run none at once.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    """
+    monkeypatch.chdir(tmpdir)
+    vulture = os.path.join(tmpdir, "vulture")
+    with open(vulture, "w") as fout:
+        fout.write('#!/bin/sh\necho "$1" >> runs\necho "_.name  # $1"\n')
+
+    os.chmod(vulture, 0o755)
+    os.mkdir("pkg")
+    for path in ("conf.py", os.path.join("pkg", "mod.py")):
+        with open(path, "w") as fout:
+            fout.write("name = 1\n")
+
+    whitelist = os.path.join(tmpdir, "whitelist.py")
+    monkeypatch.setattr(dotpy.repo_whitelist, "WHITELISTPATH", whitelist)
+    sys.argv = ["repo_whitelist", "-e", vulture, "-j", "2", "-f"]
+    sys.argv.extend(["pkg", "conf.py", "missing.py"])
+    for _ in range(2):
+        dotpy.repo_whitelist.main()
+
+    with open("runs") as fin:
+        assert sorted(fin.read().split()) == ["conf.py", "pkg"]
+
+    with open(os.path.join("pkg", "mod.py"), "a") as fout:
+        fout.write("other = 2\n")
+
+    dotpy.repo_whitelist.main()
+    with open("runs") as fin:
+        assert sorted(fin.read().split()) == ["conf.py", "pkg", "pkg"]
+
+    with open(whitelist) as fin:
+        assert fin.read() == "_.name  # pkg\n_.name  # conf.py\n"
+
+    assert nocolorcapsys.readouterr()[0].splitlines()[1::2] == [
+        "created `whitelist.py'",
+        "`whitelist.py' is already up to date",
+        "`whitelist.py' is already up to date",
+    ]
+    sys.argv[4] = "0"
+    with pytest.raises(SystemExit):
+        dotpy.repo_whitelist.main()
+
+    assert "--jobs must be at least 1" in nocolorcapsys.readouterr()[1]
+
+
+def test_reporeqs(tmpdir, monkeypatch, nocolorcapsys):
+    """Test that ``reporeqs`` writes ``requirements.txt`` from the
+    packages in ``Pipfile.lock`` without their markers, and does nothing
+    while the lock and the file are the same as the last time.
+
+    :param tmpdir:          The temporary directory ``pytest`` fixture.
+    :param monkeypatch:     ``pytest`` fixture for mocking attributes.
+    :param nocolorcapsys:   The ``capsys`` fixture altered to remove
+                            ANSI escape codes.
+    """
+    lockpath = os.path.join(tmpdir, "Pipfile.lock")
+    reqpath = os.path.join(tmpdir, "requirements.txt")
+    monkeypatch.setattr(dotpy.reporeqs, "LOCKPATH", lockpath)
+    monkeypatch.setattr(dotpy.reporeqs, "REQPATH", reqpath)
+    lock = {
+        "_meta": {"hash": {"sha256": "1"}},
+        "default": {
+            "appdirs": {"version": "==1.4.4", "markers": "os_name == 'nt'"},
+            "black": {"extras": ["d"], "version": "==20.8b1"},
+            "dotpy": {"editable": True, "path": "."},
+        },
+        "develop": {
+            "appdirs": {"version": "==1.4.4"},
+            "vcs": {"git": "https://host/vcs.git", "ref": "abc"},
+        },
+    }
+    with open(lockpath, "w") as fout:
+        json.dump(lock, fout)
+
+    sys.argv = ["reporeqs", "--executable", "pipfile2req"]
+    dotpy.reporeqs.main()
+    mtime = os.stat(reqpath).st_mtime_ns
+    dotpy.reporeqs.main()
+    assert os.stat(reqpath).st_mtime_ns == mtime
+    with open(reqpath) as fin:
+        assert fin.read().splitlines() == [
+            "-e .",
+            "appdirs==1.4.4",
+            "black[d]==20.8b1",
+            "git+https://host/vcs.git@abc#egg=vcs",
+        ]
+
+    lock["_meta"]["hash"]["sha256"] = "2"
+    del lock["develop"]["vcs"]
+    with open(lockpath, "w") as fout:
+        json.dump(lock, fout)
+
+    dotpy.reporeqs.main()
+    assert nocolorcapsys.readouterr()[0].splitlines()[1::2] == [
+        "created `requirements.txt'",
+        "`requirements.txt' is already up to date",
+        "updated `requirements.txt'",
+    ]
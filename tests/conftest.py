@@ -140,6 +140,9 @@ def dot_constants(nocolorcapsys, monkeypatch, tmpdir, entry_point):
     dotpy.install.CONFIG = os.path.join(
         dotpy.install.CONFIGDIR, __name__ + ".yaml"
     )
+    monkeypatch.setattr(
+        dotpy.src, "CONFIGDIR", dotpy.install.CONFIGDIR, raising=False
+    )
 
 
 @pytest.fixture(name="dotclone")